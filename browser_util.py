@@ -1,9 +1,24 @@
 # pylint: disable=import-error,missing-module-docstring,missing-class-docstring,missing-function-docstring,too-few-public-methods,too-many-instance-attributes,too-many-arguments,too-many-positional-arguments,too-many-locals,line-too-long,logging-fstring-interpolation,broad-exception-caught
 import asyncio
 import logging
+import os
+import random
 import pyppeteer
 
 FAKE_USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/114.0.0.0 Safari/537.36"
+# N/B: these are Chrome DevTools Protocol resource types (lowercased by 'pyppeteer');
+# e.g. beacons sent via 'navigator.sendBeacon' show up as "ping"
+DEFAULT_BLOCKED_RESOURCE_TYPES = frozenset(
+    ["image", "stylesheet", "font", "media", "texttrack", "ping"]
+)
+DISK_CACHE_SIZE_BYTES = 256 * 1024 * 1024
+# N/B: 'pyppeteer' already launches with most of the usual "fast headless" flags
+# (e.g. --disable-extensions, --disable-sync, --disable-dev-shm-usage, --mute-audio),
+# so this is only what it leaves out (outside of Windows); '--no-sandbox' is deliberately not included,
+# since we are loading third-party pages (pass it in explicitly if running as root in a container)
+DEFAULT_BROWSER_ARGS = ("--disable-gpu",)
+MAX_RETRY_DELAY_SECONDS = 60
+CLOSE_PAGE_TIMEOUT_SECONDS = 30
 logger = logging.getLogger(__name__)
 
 
@@ -18,14 +33,42 @@ class BrowserUtil:
         max_attempts_for_network_error,
         max_attempts_for_other_error,
         user_agent=None,
+        pool_size=1,
+        blocked_resource_types=None,
+        user_data_dir=None,
+        browser_args=DEFAULT_BROWSER_ARGS,
+        reuse_pages=False,
+        max_runs_per_page=None,
     ):
         self.browser = None
-        self.page = None
+        self.is_browser_connected = False
+        self.browser_lock = asyncio.Lock()
+        # Bounds the number of browser contexts (each with a single page)
+        # that can be open at once across concurrent runs
+        self.pool_semaphore = asyncio.Semaphore(pool_size)
         self.single_browser_run_timeout_seconds = single_browser_run_timeout_seconds
         self.retry_delay_seconds = retry_delay_seconds
         self.max_attempts_for_network_error = max_attempts_for_network_error
         self.max_attempts_for_other_error = max_attempts_for_other_error
         self.user_agent = user_agent
+        # Requests for these resource types are aborted, since we only care about the rendered HTML;
+        # leave this as None for pages that rely on (e.g.) CSS to determine element visibility
+        self.blocked_resource_types = blocked_resource_types
+        # A persistent profile lets Chromium's on-disk HTTP cache survive across runs (and process restarts),
+        # so static assets are not re-downloaded on every navigation; this is opt-in, since the profile (and its cookies)
+        # is shared by every page, and Chromium locks it against other browsers. None uses throwaway incognito contexts
+        self.user_data_dir = user_data_dir
+        # Extra Chromium command line flags, on top of the defaults from 'pyppeteer'
+        self.browser_args = browser_args
+        # Reusing pages across runs (rather than creating a fresh one for each URL) saves
+        # the page creation round-trips, and keeps the site's scripts warm in the page;
+        # only pages whose runs succeeded are reused, and at most 'pool_size' are kept around
+        self.reuse_pages = reuse_pages
+        # Long-lived pages slowly accumulate memory (e.g. leaked by the site's own scripts),
+        # so a reused page is replaced by a fresh one after this many runs; None never replaces it
+        self.max_runs_per_page = max_runs_per_page
+        # (page, number of runs so far) for each page that is waiting to be reused
+        self.idle_pages = []
 
     async def run_with_browser_page_for_url(
         self,
@@ -36,13 +79,87 @@ class BrowserUtil:
         wait_for_selector=None,
         timeout=None,
         validate_after_navigate=None,
-        current_attempt=1,
     ):
-        await self._maybe_close_page()
+        current_attempt = 1
+        while True:
+            try:
+                async with self.pool_semaphore:
+                    return await self._run_in_page(
+                        url=url,
+                        callback_on_page=callback_on_page,
+                        debug_logging_name=debug_logging_name,
+                        wait_until=wait_until,
+                        wait_for_selector=wait_for_selector,
+                        timeout=timeout,
+                        validate_after_navigate=validate_after_navigate,
+                    )
+
+            except (asyncio.TimeoutError, pyppeteer.errors.NetworkError) as e:
+                if current_attempt >= self.max_attempts_for_network_error:
+                    logger.error(
+                        f"Timeout or network error for {debug_logging_name} (attempt {current_attempt}), giving up!"
+                    )
+                    logger.error(e)
+                    return None
+
+                logger.warning(
+                    f"Timeout or network error for {debug_logging_name} (attempt {current_attempt}), retrying!"
+                )
+                logger.debug(e)
+
+            except Exception as e:
+                if current_attempt >= self.max_attempts_for_other_error:
+                    logger.error(
+                        f"Unexpected error for {debug_logging_name} (attempt {current_attempt}), giving up!"
+                    )
+                    logger.error(e)
+                    return None
+
+                logger.warning(
+                    f"Unexpected error for {debug_logging_name} (attempt {current_attempt}), retrying!"
+                )
+                logger.warning(e)
+
+            # N/B: the final attempt returns above without reaching here,
+            # so we never sleep just to give up afterwards;
+            # the delay doubles with each attempt (so persistent failures back off from the site),
+            # with some jitter so that concurrent runs that failed together don't all retry together
+            await asyncio.sleep(
+                min(
+                    MAX_RETRY_DELAY_SECONDS,
+                    self.retry_delay_seconds * 2 ** (current_attempt - 1),
+                )
+                + random.uniform(0, 1)
+            )
+            current_attempt += 1
 
+    async def _run_in_page(
+        self,
+        url,
+        callback_on_page,
+        debug_logging_name,
+        wait_until,
+        wait_for_selector,
+        timeout,
+        validate_after_navigate,
+    ):
+        page = None
+        num_runs = 0
+        is_page_reusable = False
         try:
-            return await asyncio.wait_for(
-                self._inner_run_with_browser_page_for_url(
+            # N/B: 'asyncio.timeout' (the stdlib successor of 'async_timeout') cancels the current task directly,
+            # rather than wrapping the run in an extra task like 'asyncio.wait_for' does;
+            # creating the page happens inside the timeout too, so that a hung browser can't hold a pool slot forever
+            async with asyncio.timeout(self.single_browser_run_timeout_seconds):
+                if self.idle_pages:
+                    logger.debug(f"Reusing page for {debug_logging_name}")
+                    page, num_runs = self.idle_pages.pop()
+                else:
+                    logger.debug(f"Creating page for {debug_logging_name}")
+                    page = await self._new_page()
+
+                result = await self._inner_run_with_browser_page_for_url(
+                    page=page,
                     url=url,
                     callback_on_page=callback_on_page,
                     debug_logging_name=debug_logging_name,
@@ -50,63 +167,23 @@ class BrowserUtil:
                     wait_for_selector=wait_for_selector,
                     timeout=timeout,
                     validate_after_navigate=validate_after_navigate,
-                ),
-                timeout=self.single_browser_run_timeout_seconds,
-            )
-
-        except (asyncio.TimeoutError, pyppeteer.errors.NetworkError) as e:
-            if current_attempt >= self.max_attempts_for_network_error:
-                logger.error(
-                    f"Timeout or network error for {debug_logging_name} (attempt {current_attempt}), giving up!"
-                )
-                logger.error(e)
-                return None
-
-            logger.warning(
-                f"Timeout or network error for {debug_logging_name} (attempt {current_attempt}), retrying!"
-            )
-            logger.debug(e)
-            await asyncio.sleep(self.retry_delay_seconds)
-            return await self.run_with_browser_page_for_url(
-                url=url,
-                callback_on_page=callback_on_page,
-                debug_logging_name=debug_logging_name,
-                wait_until=wait_until,
-                wait_for_selector=wait_for_selector,
-                timeout=timeout,
-                validate_after_navigate=validate_after_navigate,
-                current_attempt=current_attempt + 1,
-            )
-
-        except Exception as e:
-            if current_attempt >= self.max_attempts_for_other_error:
-                logger.error(
-                    f"Unexpected error for {debug_logging_name} (attempt {current_attempt}), giving up!"
                 )
-                logger.error(e)
-                return None
-
-            logger.warning(
-                f"Unexpected error for {debug_logging_name} (attempt {current_attempt}), retrying!"
-            )
-            logger.warning(e)
-            await asyncio.sleep(self.retry_delay_seconds)
-            return await self.run_with_browser_page_for_url(
-                url=url,
-                callback_on_page=callback_on_page,
-                debug_logging_name=debug_logging_name,
-                wait_until=wait_until,
-                wait_for_selector=wait_for_selector,
-                timeout=timeout,
-                validate_after_navigate=validate_after_navigate,
-                current_attempt=current_attempt + 1,
+            num_runs += 1
+            is_page_reusable = self.reuse_pages and (
+                self.max_runs_per_page is None or num_runs < self.max_runs_per_page
             )
+            return result
 
         finally:
-            await self._maybe_close_page()
+            if is_page_reusable:
+                self.idle_pages.append((page, num_runs))
+            # N/B: 'page' is still None if the run failed (or timed out) before a page was obtained
+            elif page is not None:
+                await self._close_page(page)
 
     async def _inner_run_with_browser_page_for_url(
         self,
+        page,
         url,
         callback_on_page,
         debug_logging_name,
@@ -115,68 +192,156 @@ class BrowserUtil:
         timeout,
         validate_after_navigate,
     ):
-        self.page = await (await self._get_browser()).newPage()
-        if self.user_agent is not None:
-            logger.debug(f"Setting user agent to {self.user_agent}")
-            await self.page.setUserAgent(self.user_agent)
-
         if timeout is None:
             logger.debug(f"Navigating to {debug_logging_name} without timeout")
-            await self.page.goto(url, waitUntil=wait_until)
+            await page.goto(url, waitUntil=wait_until)
         else:
             logger.debug(f"Navigating to {debug_logging_name} with timeout {timeout}")
             try:
-                await self.page.goto(url, waitUntil=wait_until, timeout=timeout)
+                await page.goto(url, waitUntil=wait_until, timeout=timeout)
             except pyppeteer.errors.TimeoutError as e:
                 logger.debug("Continuing after timeout for 'goto' navigation")
 
         if validate_after_navigate is not None:
             logger.debug("Validating page after 'goto' navigation")
-            if not (await validate_after_navigate(new_page=self.page)):
+            if not (await validate_after_navigate(new_page=page)):
                 return None
 
         if wait_for_selector is not None:
             logger.debug(f"Waiting for selector {wait_for_selector}")
-            await self.page.waitForSelector(wait_for_selector)
+            await page.waitForSelector(wait_for_selector)
 
         return await callback_on_page(
-            page=self.page,
+            page=page,
             debug_logging_name=debug_logging_name,
         )
 
+    async def _block_or_continue_request(self, request):
+        # N/B: this runs as a fire-and-forget task, so its errors are caught here rather than left unretrieved;
+        # they are expected when (e.g.) the page is closed while its requests are still in flight
+        try:
+            if request.resourceType in self.blocked_resource_types:
+                await request.abort()
+            else:
+                await request.continue_()
+        except Exception as e:
+            logger.debug(f"Could not block or continue request for {request.url}: {e}")
+
     async def _get_browser(self):
-        if self.browser is None:
-            logger.debug("Launching browser")
-            self.browser = await pyppeteer.launch(
-                headless=True, dumpio=False, logLevel=logger.level, autoClose=False
-            )
-        else:
-            logger.debug("Browser already exists, using existing browser")
+        # Concurrent runs may all ask for the browser at once; make sure we only launch one
+        async with self.browser_lock:
+            if self.browser is None and os.getenv("BROWSER_WS"):
+                # Attaching to an already-running browser skips paying for its startup on every run
+                logger.debug(f"Connecting to browser at {os.getenv('BROWSER_WS')}")
+                self.browser = await pyppeteer.connect(
+                    browserWSEndpoint=os.getenv("BROWSER_WS"),
+                    logLevel=logger.level,
+                )
+                self.is_browser_connected = True
+            elif self.browser is None:
+                logger.debug("Launching browser")
+                launch_options = {"args": list(self.browser_args)}
+                if self.user_data_dir is not None:
+                    logger.debug(f"Using browser profile at {self.user_data_dir}")
+                    os.makedirs(self.user_data_dir, exist_ok=True)
+                    launch_options["userDataDir"] = self.user_data_dir
+                    launch_options["args"].append(
+                        f"--disk-cache-size={DISK_CACHE_SIZE_BYTES}"
+                    )
+                self.browser = await pyppeteer.launch(
+                    headless=True,
+                    dumpio=False,
+                    logLevel=logger.level,
+                    autoClose=False,
+                    **launch_options,
+                )
+            else:
+                logger.debug("Browser already exists, using existing browser")
 
         return self.browser
 
-    async def _maybe_close_page(self):
-        if self.page is not None:
-            if self.page.isClosed():
-                logger.debug("Page is already closed")
-                self.page = None
-            else:
-                logger.debug("Closing page")
-                try:
-                    await self.page.close()
-                except pyppeteer.errors.NetworkError as e:
-                    if "Target closed" in str(e):
-                        logger.warning(
-                            "Page was already closed, ignoring additional close"
-                        )
-                    else:
-                        raise e
-                self.page = None
+    async def _new_page(self):
+        browser = await self._get_browser()
+        if self.user_data_dir is not None:
+            # Incognito browser contexts never touch the on-disk profile (and its cache),
+            # so we open pages in the default browser context instead
+            page = await browser.newPage()
         else:
-            logger.debug("No page to close")
+            # Incognito browser contexts are cheap to create, and isolate concurrent runs from each other
+            browser_context = await browser.createIncognitoBrowserContext()
+            try:
+                page = await browser_context.newPage()
+            except BaseException:
+                # N/B: including cancellation by the run's timeout, so that the context isn't leaked
+                await browser_context.close()
+                raise
+
+        try:
+            await self._set_up_page(page)
+        except BaseException:
+            # N/B: including cancellation by the run's timeout, so that a half-set-up page isn't leaked
+            await self._close_page(page)
+            raise
+        return page
+
+    async def _set_up_page(self, page):
+        # N/B: this is set up once per page (rather than once per run), since pages may be reused
+        if self.user_agent is not None:
+            logger.debug(f"Setting user agent to {self.user_agent}")
+            await page.setUserAgent(self.user_agent)
+        if self.blocked_resource_types:
+            logger.debug(
+                f"Blocking resource types {sorted(self.blocked_resource_types)}"
+            )
+            # N/B: this also disables the HTTP cache for the page, which has to stay that way;
+            # responses served from the cache are never intercepted, so they would be left unmatched
+            # in the bookkeeping that 'pyppeteer' uses to pair up intercepted requests
+            await page.setRequestInterception(True)
+            page.on(
+                "request",
+                lambda request: asyncio.ensure_future(
+                    self._block_or_continue_request(request)
+                ),
+            )
+
+    async def _close_page(self, page):
+        browser_context = page.target.browserContext
+        try:
+            # N/B: closing runs outside of the run's own timeout (e.g. in its 'finally'),
+            # so it gets a timeout of its own, rather than letting a stuck browser hang the run forever
+            async with asyncio.timeout(CLOSE_PAGE_TIMEOUT_SECONDS):
+                if browser_context.isIncognito():
+                    # N/B: even if the page itself is already closed, its browser context still needs closing
+                    logger.debug("Closing browser context")
+                    await browser_context.close()
+                elif page.isClosed():
+                    # Cheap check for the common case, rather than relying on the error below
+                    logger.debug("Page was already closed, skipping close")
+                else:
+                    logger.debug("Closing page")
+                    await page.close()
+        except TimeoutError:
+            logger.error(
+                f"Timed out closing page after {CLOSE_PAGE_TIMEOUT_SECONDS} seconds, leaving it open"
+            )
+        except pyppeteer.errors.NetworkError as e:
+            if "Target closed" in str(e):
+                logger.warning("Page was already closed, ignoring additional close")
+            else:
+                raise e
 
     async def maybe_close_browser(self):
-        if self.browser is not None:
+        while self.idle_pages:
+            page, _ = self.idle_pages.pop()
+            await self._close_page(page)
+
+        if self.browser is not None and self.is_browser_connected:
+            # Leave the browser running for the next run to connect to
+            logger.debug("Disconnecting from browser")
+            await self.browser.disconnect()
+            self.browser = None
+            self.is_browser_connected = False
+        elif self.browser is not None:
             logger.debug("Closing browser")
             await self.browser.close()
             self.browser = None
@@ -205,21 +370,26 @@ def get_single_rendered_html_browser_page_callback(
     return _callback
 
 
-def get_paged_rendered_html_browser_page_callback(
-    initial_action=None, pagination_action=None
+# Evaluates 'page_function' (JavaScript) on each page, and keeps only its results;
+# useful when we only need a small part of each page, since the page's HTML never leaves the browser
+def get_paged_evaluated_browser_page_callback(
+    page_function, wait_for_selector=None, initial_action=None, pagination_action=None
 ):
     async def _callback(page, debug_logging_name):
-        htmls = []
+        results = []
+
+        if wait_for_selector is not None:
+            logger.debug(
+                f"Waiting for selector {wait_for_selector} of {debug_logging_name}"
+            )
+            await page.waitForSelector(wait_for_selector)
 
         if initial_action is not None:
             await initial_action(page=page, debug_logging_name=debug_logging_name)
 
-        logger.info(f"Extracting rendered HTML from {debug_logging_name} (page 1)")
-        html = await page.content()
-        logger.debug(
-            f"Successfully extracted rendered HTML from {debug_logging_name} (page 1)"
-        )
-        htmls.append(html)
+        logger.info(f"Extracting from {debug_logging_name} (page 1)")
+        results.append(await page.evaluate(page_function))
+        logger.debug(f"Successfully extracted from {debug_logging_name} (page 1)")
 
         if pagination_action is not None:
             page_num = 1
@@ -235,15 +405,12 @@ def get_paged_rendered_html_browser_page_callback(
                     break
                 page_num += 1
 
-                logger.info(
-                    f"Extracting rendered HTML from {debug_logging_name} (page {page_num})"
-                )
-                html = await page.content()
+                logger.info(f"Extracting from {debug_logging_name} (page {page_num})")
+                results.append(await page.evaluate(page_function))
                 logger.debug(
-                    f"Successfully extracted rendered HTML from {debug_logging_name} (page {page_num})"
+                    f"Successfully extracted from {debug_logging_name} (page {page_num})"
                 )
-                htmls.append(html)
 
-        return htmls
+        return results
 
     return _callback
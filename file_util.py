@@ -8,6 +8,9 @@ BASE_INFO_FILENAME = "listing_info.csv"
 FULL_RESULTS_FILENAME = "listings.csv"
 PG_LISTINGS_FILENAME = "pg_listing_urls.csv"
 PG_FULL_RESULTS_FILENAME = "pg_listings.csv"
+HDB_BROWSER_PROFILE_FOLDER = ".pyppeteer_profile_hdb"
+PG_BROWSER_PROFILE_FOLDER = ".pyppeteer_profile_pg"
+GMAPS_CACHE_FILENAME = "gmaps_cache"
 
 
 def maybe_create_output_folder():
@@ -1,36 +1,181 @@
 # pylint: disable=import-error,missing-module-docstring,missing-class-docstring,missing-function-docstring,too-few-public-methods,too-many-instance-attributes,too-many-arguments,too-many-positional-arguments,too-many-locals,line-too-long,logging-fstring-interpolation,broad-exception-caught
+import atexit
+import concurrent.futures
+import functools
 import math
 import os
+import shelve
 import googlemaps
+import requests
+import file_util
+
+MAX_CONCURRENT_REQUESTS = 10
+# The Distance Matrix API allows at most 25 origins per request
+MAX_ORIGINS_PER_DISTANCE_MATRIX_REQUEST = 25
 
 
 def get_gmaps_client():
     api_key = os.getenv("GOOGLE_MAPS_API_KEY")
-    return googlemaps.Client(key=api_key)
+    # N/B: the client is shared by up to 'MAX_CONCURRENT_REQUESTS' threads at once,
+    # so its connection pool is sized to match; otherwise connections beyond the pool size
+    # would be thrown away after each request, rather than being kept alive and reused
+    session = requests.Session()
+    session.mount(
+        "https://",
+        requests.adapters.HTTPAdapter(
+            pool_connections=1, pool_maxsize=MAX_CONCURRENT_REQUESTS
+        ),
+    )
+    return googlemaps.Client(key=api_key, requests_session=session)
+
+
+# The Geocoding API only takes a single address per request,
+# so the best we can do is to have several requests in flight at once
+def get_lat_lon_from_addresses(gmaps, addresses):
+    disk_cache = _get_disk_cache()
+    uncached_addresses = list(
+        dict.fromkeys(
+            address
+            for address in addresses
+            if _get_geocode_cache_key(address=address) not in disk_cache
+        )
+    )
+    try:
+        for address, lat_lon in _map_concurrently(
+            fn=lambda address: _get_lat_lon_from_address_uncached(
+                gmaps=gmaps, address=address
+            ),
+            items=uncached_addresses,
+        ):
+            disk_cache[_get_geocode_cache_key(address=address)] = lat_lon
+    finally:
+        disk_cache.sync()
+    return [
+        disk_cache[_get_geocode_cache_key(address=address)] for address in addresses
+    ]
 
 
-def get_lat_lon_from_address(gmaps, address):
+def _get_lat_lon_from_address_uncached(gmaps, address):
     geocode_result = gmaps.geocode(address=address)
     assert geocode_result is not None
     location = geocode_result[0]["geometry"]["location"]
     return (location["lat"], location["lng"])
 
 
-def get_walking_distance_and_duration(gmaps, start, end):
+# Returns a dict of (start, end) -> (distance_metres, duration_seconds).
+# N/B: the Distance Matrix API bills per element (i.e. per origin-destination pair),
+# so rather than asking for the full matrix of all starts and ends,
+# we group the starts by their end and make one request per end (per chunk of starts)
+def get_walking_distances_and_durations(gmaps, starts_and_ends):
+    disk_cache = _get_disk_cache()
+    starts_by_end = {}
+    for start, end in starts_and_ends:
+        if _get_walking_cache_key(start=start, end=end) in disk_cache:
+            continue
+        # N/B: dict (rather than set) to de-duplicate while keeping the order deterministic
+        starts_by_end.setdefault(end, {})[start] = None
+
+    distance_matrix_requests = []
+    for end, starts in starts_by_end.items():
+        starts = list(starts)
+        for i in range(0, len(starts), MAX_ORIGINS_PER_DISTANCE_MATRIX_REQUEST):
+            distance_matrix_requests.append(
+                (starts[i : i + MAX_ORIGINS_PER_DISTANCE_MATRIX_REQUEST], end)
+            )
+    uncached_results = {}
+    try:
+        for _, result in _map_concurrently(
+            fn=lambda request: _get_walking_distances_and_durations_to_end(
+                gmaps=gmaps, starts=request[0], end=request[1]
+            ),
+            items=distance_matrix_requests,
+        ):
+            uncached_results.update(result)
+            for (start, end), distance_and_duration in result.items():
+                # N/B: "NOT_FOUND" results are not cached, since they may well be found on a later run
+                # (e.g. once the address is known to Google Maps), and would otherwise never be retried
+                if distance_and_duration != (None, None):
+                    disk_cache[_get_walking_cache_key(start=start, end=end)] = (
+                        distance_and_duration
+                    )
+    finally:
+        disk_cache.sync()
+    return {
+        (start, end): (
+            uncached_results[(start, end)]
+            if (start, end) in uncached_results
+            else disk_cache[_get_walking_cache_key(start=start, end=end)]
+        )
+        for start, end in starts_and_ends
+    }
+
+
+def _get_walking_distances_and_durations_to_end(gmaps, starts, end):
     gmaps_result = gmaps.distance_matrix(
-        origins=[_adapt_location_name_for_distance_matrix(location_name=start)],
+        origins=[
+            _adapt_location_name_for_distance_matrix(location_name=start)
+            for start in starts
+        ],
         destinations=[_adapt_location_name_for_distance_matrix(location_name=end)],
         mode="walking",
     )
-    gmaps_result_inner = gmaps_result["rows"][0]["elements"][0]
-    if gmaps_result_inner["status"] == "OK":
-        distance_metres = gmaps_result_inner["distance"]["value"]
-        duration_seconds = gmaps_result_inner["duration"]["value"]
+    assert len(gmaps_result["rows"]) == len(starts)
+    return {
+        (start, end): _parse_distance_matrix_element(row["elements"][0])
+        for start, row in zip(starts, gmaps_result["rows"])
+    }
+
+
+# Yields (item, fn(item)) for each item, in the order that the calls complete.
+# N/B: 'shelve' is not thread-safe, so only the calls happen in the threads, and the caller caches each result as it is yielded;
+# a failed call does not stop the others, so every successful (already paid for) result is still yielded before the first failure is re-raised
+def _map_concurrently(fn, items):
+    first_exception = None
+    with concurrent.futures.ThreadPoolExecutor(
+        max_workers=MAX_CONCURRENT_REQUESTS
+    ) as executor:
+        items_by_future = {executor.submit(fn, item): item for item in items}
+        for future in concurrent.futures.as_completed(items_by_future):
+            try:
+                result = future.result()
+            except Exception as e:
+                if first_exception is None:
+                    first_exception = e
+                continue
+            yield items_by_future[future], result
+    if first_exception is not None:
+        raise first_exception
+
+
+def _parse_distance_matrix_element(gmaps_result_element):
+    if gmaps_result_element["status"] == "OK":
+        distance_metres = gmaps_result_element["distance"]["value"]
+        duration_seconds = gmaps_result_element["duration"]["value"]
         return (distance_metres, duration_seconds)
-    assert gmaps_result_inner["status"] == "NOT_FOUND"
+    assert gmaps_result_element["status"] == "NOT_FOUND"
     return (None, None)
 
 
+# Geocodes and walking distances essentially never change between runs,
+# so they are cached on disk to avoid paying for the same API calls again
+@functools.lru_cache(maxsize=None)
+def _get_disk_cache():
+    file_util.maybe_create_output_folder()
+    disk_cache = shelve.open(
+        os.path.join(file_util.OUTPUT_FOLDER, file_util.GMAPS_CACHE_FILENAME)
+    )
+    atexit.register(disk_cache.close)
+    return disk_cache
+
+
+def _get_geocode_cache_key(address):
+    return f"geocode:{address}"
+
+
+def _get_walking_cache_key(start, end):
+    return f"walking:{start}|{end}"
+
+
 def _adapt_location_name_for_distance_matrix(location_name):
     if location_name == "HarbourFront MRT station":
         # Don't ask me why, but Google Maps chokes on the name
@@ -42,15 +187,69 @@ def _adapt_location_name_for_distance_matrix(location_name):
 
 # Approximation, based on great-circle distance
 def haversine_distance_km(lat1, lon1, lat2, lon2):
-    earth_radius = 6371.0  # Radius of the Earth in kilometers
+    return haversine_distances_km(lat1=lat1, lon1=lon1, lats2=[lat2], lons2=[lon2])[0]
+
+
+# Same as 'haversine_distance_km', but from a single point to many points at once,
+# so that the trigonometry for the single point is only computed once
+def haversine_distances_km(lat1, lon1, lats2, lons2):
+    lat2_rads = [math.radians(lat2) for lat2 in lats2]
+    return haversine_distances_km_from_radians(
+        lat1=lat1,
+        lon1=lon1,
+        lat2_rads=lat2_rads,
+        lon2_rads=[math.radians(lon2) for lon2 in lons2],
+        cos_lat2s=[math.cos(lat2_rad) for lat2_rad in lat2_rads],
+    )
+
+
+# Same as 'haversine_distances_km', but with the many points already converted to radians
+# (along with the cosines of their latitudes), so that callers which query the same many points
+# over and over again only need to compute these once
+def haversine_distances_km_from_radians(lat1, lon1, lat2_rads, lon2_rads, cos_lat2s):
+    return [
+        _haversine_distance_km_from_a(a=a)
+        for a in _haversine_as_from_radians(
+            lat1=lat1,
+            lon1=lon1,
+            lat2_rads=lat2_rads,
+            lon2_rads=lon2_rads,
+            cos_lat2s=cos_lat2s,
+        )
+    ]
+
+
+# Returns the index of the nearest of the many points, along with its distance.
+# N/B: the distance only ever increases with the haversine's intermediate 'a',
+# so the many points are ranked by 'a' alone, and only the nearest one is converted into a distance
+def nearest_haversine_distance_km_from_radians(
+    lat1, lon1, lat2_rads, lon2_rads, cos_lat2s
+):
+    haversine_as = _haversine_as_from_radians(
+        lat1=lat1,
+        lon1=lon1,
+        lat2_rads=lat2_rads,
+        lon2_rads=lon2_rads,
+        cos_lat2s=cos_lat2s,
+    )
+    nearest_index = min(range(len(haversine_as)), key=haversine_as.__getitem__)
+    return nearest_index, _haversine_distance_km_from_a(a=haversine_as[nearest_index])
+
+
+def _haversine_as_from_radians(lat1, lon1, lat2_rads, lon2_rads, cos_lat2s):
     lat1_rad = math.radians(lat1)
     lon1_rad = math.radians(lon1)
-    lat2_rad = math.radians(lat2)
-    lon2_rad = math.radians(lon2)
-    dlat = lat2_rad - lat1_rad
-    dlon = lon2_rad - lon1_rad
-    a = (
-        math.sin(dlat / 2) ** 2
-        + math.cos(lat1_rad) * math.cos(lat2_rad) * math.sin(dlon / 2) ** 2
-    )
+    cos_lat1 = math.cos(lat1_rad)
+    haversine_as = []
+    for lat2_rad, lon2_rad, cos_lat2 in zip(lat2_rads, lon2_rads, cos_lat2s):
+        dlat = lat2_rad - lat1_rad
+        dlon = lon2_rad - lon1_rad
+        haversine_as.append(
+            math.sin(dlat / 2) ** 2 + cos_lat1 * cos_lat2 * math.sin(dlon / 2) ** 2
+        )
+    return haversine_as
+
+
+def _haversine_distance_km_from_a(a):
+    earth_radius = 6371.0  # Radius of the Earth in kilometers
     return earth_radius * 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
@@ -1,9 +1,12 @@
 # pylint: disable=import-error,missing-module-docstring,missing-class-docstring,missing-function-docstring,too-few-public-methods,too-many-instance-attributes,too-many-arguments,too-many-positional-arguments,too-many-locals,line-too-long,logging-fstring-interpolation,broad-exception-caught
 import argparse
 import asyncio
+import concurrent.futures
 import csv
 import dataclasses
 import logging
+import multiprocessing
+import operator
 import os
 import typing
 import bs4
@@ -13,13 +16,16 @@ import hdb_parsing_util
 
 SINGLE_BROWSER_RUN_TIMEOUT_SECONDS = 5 * 60
 DELAY_PER_LISTING_LOAD_SECONDS = 1
+DEFAULT_NUM_CONCURRENT_LISTING_LOADS = 4
+MAX_LISTING_LOADS_PER_PAGE = 50
+FSYNC_EVERY_NUM_ROWS = 25
 RETRY_DELAY_SECONDS = 5
 MAX_ATTEMPTS_FOR_NETWORK_ERROR = 5
 MAX_ATTEMPTS_FOR_OTHER_ERROR = 3
 logger = logging.getLogger(__name__)
 
 
-async def _scrape_listings():
+async def _scrape_listings(num_concurrent_listing_loads, use_browser_profile):
     logger.info(f"Starting to scrape all listings from {file_util.LISTINGS_FILENAME}")
 
     output_file_exists, already_processed_urls = _get_already_processed_urls()
@@ -28,6 +34,15 @@ async def _scrape_listings():
         retry_delay_seconds=RETRY_DELAY_SECONDS,
         max_attempts_for_network_error=MAX_ATTEMPTS_FOR_NETWORK_ERROR,
         max_attempts_for_other_error=MAX_ATTEMPTS_FOR_OTHER_ERROR,
+        pool_size=num_concurrent_listing_loads,
+        blocked_resource_types=browser_util.DEFAULT_BLOCKED_RESOURCE_TYPES,
+        reuse_pages=True,
+        max_runs_per_page=MAX_LISTING_LOADS_PER_PAGE,
+        user_data_dir=(
+            os.path.join(file_util.OUTPUT_FOLDER, file_util.HDB_BROWSER_PROFILE_FOLDER)
+            if use_browser_profile
+            else None
+        ),
     )
 
     with open(
@@ -40,56 +55,81 @@ async def _scrape_listings():
         newline="",
         encoding="utf-8",
     ) as base_info_file:
-        listings_reader = csv.reader(listings_file)
         base_info_writer = csv.writer(base_info_file)
 
         if not output_file_exists:
             _write_base_info_headers(base_info_writer=base_info_writer)
 
-        listing_urls = list(listings_reader)
-        num_listings = len(listing_urls)
-        num_written = 0
-        for listing_index, listing_row in enumerate(listing_urls):
-            assert len(listing_row) == 1
-            listing_url = listing_row[0]
-            debug_logging_name = (
-                f"{listing_url} (listing #{listing_index+1} of {num_listings})"
-            )
-
-            if listing_url in already_processed_urls:
-                logger.info(
-                    f"Skipping {debug_logging_name} because it is already processed"
-                )
-                continue
+        pending_listings = _get_pending_listings(
+            listings_file=listings_file,
+            already_processed_urls=already_processed_urls,
+        )
 
-            listing_info = await _scrape_single_listing(
-                listing_url=listing_url,
-                debug_logging_name=debug_logging_name,
-                browser=browser,
-            )
-            if listing_info is None:
-                logger.warning(
-                    f"Unable to scrape {debug_logging_name}, skipping writing to {file_util.BASE_INFO_FILENAME}"
+        # Loading a listing is almost entirely waiting on the network,
+        # so we have a few workers loading listings at once (each in its own page);
+        # N/B: each worker pulls its next listing as soon as it is done with its previous one,
+        # so a single slow listing does not hold up the others
+        base_info_output = BaseInfoOutput(
+            base_info_file=base_info_file,
+            base_info_writer=base_info_writer,
+            base_info_lock=asyncio.Lock(),
+            num_written=0,
+            num_written_since_fsync=0,
+        )
+        # Parsing a listing is CPU-bound, so it happens in separate processes
+        # to avoid stalling the event loop (and thus the other workers' pages);
+        # N/B: the processes are spawned rather than forked, since they only start once the browser is already running,
+        # and a forked process would inherit the browser connection, its threads, and 'pyppeteer''s signal handlers
+        with concurrent.futures.ProcessPoolExecutor(
+            max_workers=num_concurrent_listing_loads,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_parse_process,
+            initargs=(logging.getLogger().level,),
+        ) as parse_executor:
+            try:
+                await asyncio.gather(
+                    *[
+                        _scrape_listings_worker(
+                            pending_listings=pending_listings,
+                            browser=browser,
+                            parse_executor=parse_executor,
+                            base_info_output=base_info_output,
+                        )
+                        for _ in range(num_concurrent_listing_loads)
+                    ]
                 )
-                continue
 
-            _write_base_info_row(
-                base_info_writer=base_info_writer, listing_info=listing_info
-            )
-            num_written += 1
-            base_info_file.flush()
-            os.fsync(base_info_file.fileno())
-
-            # Artificially make this slower so HDB doesn't block us... :)
-            await asyncio.sleep(DELAY_PER_LISTING_LOAD_SECONDS)
+            finally:
+                base_info_file.flush()
+                os.fsync(base_info_file.fileno())
 
         logger.info(
-            f"Successfully exported {num_written} scraped results to {file_util.BASE_INFO_FILENAME}"
+            f"Successfully exported {base_info_output.num_written} scraped results to {file_util.BASE_INFO_FILENAME}"
         )
 
     await browser.maybe_close_browser()
 
 
+# Streams the listings (rather than holding all of them in memory),
+# yielding (listing_url, debug_logging_name) for those not already processed
+def _get_pending_listings(listings_file, already_processed_urls):
+    num_listings = sum(1 for _ in csv.reader(listings_file))
+    listings_file.seek(0)
+    for listing_index, listing_row in enumerate(csv.reader(listings_file)):
+        (listing_url,) = listing_row
+        debug_logging_name = (
+            f"{listing_url} (listing #{listing_index+1} of {num_listings})"
+        )
+
+        if listing_url in already_processed_urls:
+            logger.info(
+                f"Skipping {debug_logging_name} because it is already processed"
+            )
+            continue
+
+        yield listing_url, debug_logging_name
+
+
 def _get_already_processed_urls():
     logger.debug(
         f"Getting already-processed listings from {file_util.BASE_INFO_FILENAME}"
@@ -98,18 +138,79 @@ def _get_already_processed_urls():
         os.path.join(file_util.OUTPUT_FOLDER, file_util.BASE_INFO_FILENAME)
     ):
         logger.debug(f"{file_util.BASE_INFO_FILENAME} does not exist yet!")
-        return False, {}
+        return False, set()
     with open(
         os.path.join(file_util.OUTPUT_FOLDER, file_util.BASE_INFO_FILENAME),
         newline="",
         encoding="utf-8",
     ) as base_info_file:
-        dict_reader = csv.DictReader(base_info_file)
-        already_processed_urls = set(row["Link"] for row in dict_reader)
+        # N/B: "Link" is always the first column, so there's no need to build a dict for every row
+        reader = csv.reader(base_info_file)
+        next(reader, None)  # Skip the headers
+        already_processed_urls = {row[0] for row in reader}
         logger.info(f"{len(already_processed_urls)} already-processed listings found!")
         return True, already_processed_urls
 
 
+@dataclasses.dataclass
+class BaseInfoOutput:
+    base_info_file: typing.Any
+    base_info_writer: typing.Any
+    base_info_lock: typing.Any
+    num_written: typing.Any
+    num_written_since_fsync: typing.Any
+
+
+# N/B: the workers all share the same 'pending_listings' generator,
+# which is safe since pulling from it never yields control to the event loop
+async def _scrape_listings_worker(
+    pending_listings, browser, parse_executor, base_info_output
+):
+    for listing_url, debug_logging_name in pending_listings:
+        await _scrape_and_write_single_listing(
+            listing_url=listing_url,
+            debug_logging_name=debug_logging_name,
+            browser=browser,
+            parse_executor=parse_executor,
+            base_info_output=base_info_output,
+        )
+
+
+async def _scrape_and_write_single_listing(
+    listing_url, debug_logging_name, browser, parse_executor, base_info_output
+):
+    listing_info = await _scrape_single_listing(
+        listing_url=listing_url,
+        debug_logging_name=debug_logging_name,
+        browser=browser,
+        parse_executor=parse_executor,
+    )
+    if listing_info is None:
+        logger.warning(
+            f"Unable to scrape {debug_logging_name}, skipping writing to {file_util.BASE_INFO_FILENAME}"
+        )
+        return
+
+    async with base_info_output.base_info_lock:
+        _write_base_info_row(
+            base_info_writer=base_info_output.base_info_writer,
+            listing_info=listing_info,
+        )
+        base_info_output.num_written += 1
+        base_info_output.num_written_since_fsync += 1
+
+        # Every row is flushed to the OS as soon as it is written,
+        # but only forced onto the disk every so often, since 'fsync' is slow;
+        # N/B: the 'fsync' happens in a separate thread so that it doesn't stall the other workers' pages
+        base_info_output.base_info_file.flush()
+        if base_info_output.num_written_since_fsync >= FSYNC_EVERY_NUM_ROWS:
+            await asyncio.to_thread(os.fsync, base_info_output.base_info_file.fileno())
+            base_info_output.num_written_since_fsync = 0
+
+    # Artificially make this slower so HDB doesn't block us... :)
+    await asyncio.sleep(DELAY_PER_LISTING_LOAD_SECONDS)
+
+
 @dataclasses.dataclass
 class ListingInfo:
     listing_url: typing.Any
@@ -117,29 +218,44 @@ class ListingInfo:
     details_info: typing.Any
 
 
-async def _scrape_single_listing(listing_url, debug_logging_name, browser):
+async def _scrape_single_listing(
+    listing_url, debug_logging_name, browser, parse_executor
+):
     logger.info(f"Starting to scrape {debug_logging_name}")
 
     logger.debug(f"Getting rendered HTML of {debug_logging_name}")
     html = await browser.run_with_browser_page_for_url(
         url=listing_url,
         callback_on_page=browser_util.get_single_rendered_html_browser_page_callback(
-            # N/B: any 'h3' tag is a simple heuristic to determine that the Angular-rendered web page has loaded
-            wait_for_selector="h3",
             additional_action=_click_expand_all_button,
         ),
         debug_logging_name=debug_logging_name,
+        # Waiting for 'networkidle0' can take (much) longer than the listing takes to render,
+        # since analytics and long-polling requests keep the network busy;
+        # instead, we wait for the content that we actually need.
+        # N/B: any 'h3' tag is a simple heuristic to determine that the Angular-rendered web page has loaded
+        wait_until="domcontentloaded",
+        wait_for_selector="h3",
     )
     if html is None:
         return None
 
     logger.debug(f"Parsing HTML of {debug_logging_name}")
-    html_soup = bs4.BeautifulSoup(html, "html.parser")
+    listing_info = await asyncio.get_running_loop().run_in_executor(
+        parse_executor, _parse_listing_html, listing_url, html
+    )
+
+    logger.info(f"Finished scraping {debug_logging_name}")
+    return listing_info
+
+
+# N/B: this runs in a separate process, so it has to stay a (picklable) top-level function
+def _parse_listing_html(listing_url, html):
+    html_soup = bs4.BeautifulSoup(html, "lxml")
 
     header_info = hdb_parsing_util.parse_header_info(html_soup=html_soup)
     details_info = hdb_parsing_util.parse_details_info(html_soup=html_soup)
 
-    logger.info(f"Finished scraping {debug_logging_name}")
     return ListingInfo(
         listing_url=listing_url,
         header_info=header_info,
@@ -147,6 +263,15 @@ async def _scrape_single_listing(listing_url, debug_logging_name, browser):
     )
 
 
+# Parse processes don't necessarily inherit our logging configuration (e.g. when they are spawned, not forked)
+def _init_parse_process(log_level):
+    logging.basicConfig(
+        level=log_level,
+        format="%(asctime)s (%(name)s) [%(levelname)s] %(message)s",
+        datefmt="%H:%M:%S",
+    )
+
+
 async def _click_expand_all_button(page, debug_logging_name):
     logger.debug(f"Waiting for 'Expand/Collapse all' button of {debug_logging_name}")
     await page.waitForSelector(".btn-secondary")
@@ -187,37 +312,49 @@ def _write_base_info_headers(base_info_writer):
     )
 
 
+# N/B: fetches all of a row's (nested) attributes in a single C-level call
+BASE_INFO_ROW_GETTER = operator.attrgetter(
+    # Key info
+    "listing_url",
+    "header_info.address",
+    "header_info.postal_code",
+    "header_info.hdb_type",
+    "details_info.ethnic_eligibility",
+    "header_info.area",
+    "header_info.price",
+    "details_info.storey_range",
+    "details_info.remaining_lease_num_years",
+    "details_info.last_updated_date",
+    "details_info.description",
+    # Useful info
+    "details_info.num_bedrooms",
+    "details_info.num_bathrooms",
+    "details_info.balcony",
+    "details_info.upgrading",
+    # Fallback scraped info
+    "header_info.sub_address",
+    "details_info.town",
+    "details_info.remaining_lease",
+    "details_info.last_updated",
+    # Mostly irrelevant info (for us)
+    "details_info.extension_of_stay",
+    "details_info.contra",
+    "details_info.spr_eligibility",
+)
+
+
 def _write_base_info_row(base_info_writer, listing_info):
-    base_info_writer.writerow(
-        [
-            # Key info
-            listing_info.listing_url,
-            listing_info.header_info.address,
-            listing_info.header_info.postal_code,
-            listing_info.header_info.hdb_type,
-            listing_info.details_info.ethnic_eligibility,
-            listing_info.header_info.area,
-            listing_info.header_info.price,
-            listing_info.details_info.storey_range,
-            listing_info.details_info.remaining_lease_num_years,
-            listing_info.details_info.last_updated_date,
-            listing_info.details_info.description,
-            # Useful info
-            listing_info.details_info.num_bedrooms,
-            listing_info.details_info.num_bathrooms,
-            listing_info.details_info.balcony,
-            listing_info.details_info.upgrading,
-            # Fallback scraped info
-            listing_info.header_info.sub_address,
-            listing_info.details_info.town,
-            listing_info.details_info.remaining_lease,
-            listing_info.details_info.last_updated,
-            # Mostly irrelevant info (for us)
-            listing_info.details_info.extension_of_stay,
-            listing_info.details_info.contra,
-            listing_info.details_info.spr_eligibility,
-        ]
-    )
+    base_info_writer.writerow(BASE_INFO_ROW_GETTER(listing_info))
+
+
+def _positive_int(value):
+    try:
+        int_value = int(value)
+    except ValueError:
+        int_value = None
+    if int_value is None or int_value < 1:
+        raise argparse.ArgumentTypeError(f"{value} is not a positive integer")
+    return int_value
 
 
 def main():
@@ -228,6 +365,17 @@ def main():
         choices=["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"],
         help="Set the logging level (default: INFO)",
     )
+    parser.add_argument(
+        "--concurrency",
+        type=_positive_int,
+        default=DEFAULT_NUM_CONCURRENT_LISTING_LOADS,
+        help=f"Set the number of listings to load at once (default: {DEFAULT_NUM_CONCURRENT_LISTING_LOADS})",
+    )
+    parser.add_argument(
+        "--browser_profile",
+        action="store_true",
+        help=f"Keep a persistent browser profile in {file_util.OUTPUT_FOLDER}/{file_util.HDB_BROWSER_PROFILE_FOLDER} across runs, rather than using throwaway incognito pages",
+    )
     args = parser.parse_args()
     logging.basicConfig(
         level=args.log_level,
@@ -236,7 +384,12 @@ def main():
     )
 
     file_util.maybe_create_output_folder()
-    asyncio.run(_scrape_listings())
+    asyncio.run(
+        _scrape_listings(
+            num_concurrent_listing_loads=args.concurrency,
+            use_browser_profile=args.browser_profile,
+        )
+    )
 
 
 if __name__ == "__main__":
@@ -4,7 +4,8 @@ import asyncio
 import csv
 import logging
 import os
-import bs4
+import urllib.parse
+import pyppeteer
 import browser_util
 import file_util
 
@@ -14,31 +15,54 @@ SINGLE_BROWSER_RUN_TIMEOUT_SECONDS = 5 * 60
 RETRY_DELAY_SECONDS = 5
 MAX_ATTEMPTS_FOR_NETWORK_ERROR = 5
 MAX_ATTEMPTS_FOR_OTHER_ERROR = 3
-NEXT_PAGE_WAIT_TIME_SECONDS = 3
+NEXT_PAGE_TIMEOUT_SECONDS = 30
+# N/B: this runs in the browser, so only the hrefs (rather than the whole page's HTML) are sent back to us
+FLAT_LINK_HREFS_PAGE_FUNCTION = """() => Array.from(
+    document.querySelectorAll("a.flat-link[href]"), link => link.getAttribute("href")
+)"""
 logger = logging.getLogger(__name__)
 
 
 async def _get_listing_urls():
     logger.info(f"Starting to get all listing URLs from {HDB_URL_MAIN}")
 
-    logger.debug(f"Getting paged HTMLs from {HDB_URL_MAIN}")
+    logger.debug(f"Getting paged listing URLs from {HDB_URL_MAIN}")
     browser = browser_util.BrowserUtil(
         single_browser_run_timeout_seconds=SINGLE_BROWSER_RUN_TIMEOUT_SECONDS,
         retry_delay_seconds=RETRY_DELAY_SECONDS,
         max_attempts_for_network_error=MAX_ATTEMPTS_FOR_NETWORK_ERROR,
         max_attempts_for_other_error=MAX_ATTEMPTS_FOR_OTHER_ERROR,
     )
-    htmls = await browser.run_with_browser_page_for_url(
+    listing_urls_per_page = await browser.run_with_browser_page_for_url(
         url=HDB_URL_MAIN,
-        callback_on_page=browser_util.get_paged_rendered_html_browser_page_callback(
+        callback_on_page=browser_util.get_paged_evaluated_browser_page_callback(
+            page_function=FLAT_LINK_HREFS_PAGE_FUNCTION,
+            # N/B: any 'h1' tag is a simple heuristic to determine that the Angular-rendered web page has loaded
+            wait_for_selector="h1",
             initial_action=_click_resale_listings_button,
             pagination_action=_click_next_page_button,
         ),
         debug_logging_name=HDB_URL_MAIN,
+        wait_until="domcontentloaded",
     )
     await browser.maybe_close_browser()
-    htmls = [] if htmls is None else htmls
-    logger.debug(f"Got {len(htmls)} paged HTMLs from {HDB_URL_MAIN}")
+    listing_urls_per_page = (
+        [] if listing_urls_per_page is None else listing_urls_per_page
+    )
+    logger.debug(f"Got {len(listing_urls_per_page)} pages from {HDB_URL_MAIN}")
+
+    # N/B: dict (rather than set) to de-duplicate while keeping the listings in page order,
+    # since a listing can show up on two pages if the listings shift while we paginate
+    all_listing_urls = {}
+    for page_index, listing_urls in enumerate(listing_urls_per_page):
+        listing_urls = _normalize_listing_urls(listing_urls=listing_urls)
+        logger.info(
+            f"Found {len(listing_urls)} listing URLs from page {page_index+1} of {HDB_URL_MAIN}"
+        )
+        all_listing_urls.update(dict.fromkeys(listing_urls))
+    logger.info(
+        f"Found {len(all_listing_urls)} unique listing URLs from {HDB_URL_MAIN}"
+    )
 
     with open(
         os.path.join(file_util.OUTPUT_FOLDER, file_util.LISTINGS_FILENAME),
@@ -47,45 +71,33 @@ async def _get_listing_urls():
         encoding="utf-8",
     ) as csvfile:
         writer = csv.writer(csvfile)
-        for page_index, html in enumerate(htmls):
-            logger.debug(
-                f"Parsing HTML page {page_index+1} of {len(htmls)} from {HDB_URL_MAIN}"
-            )
-            html_soup = bs4.BeautifulSoup(html, "html.parser")
-
-            listing_urls = [
-                listing_link["href"]
-                for listing_link in html_soup.find_all("a", class_="flat-link")
-            ]
-            listing_urls = [
-                # Many URLs are just encoded as '/home/resale/xxx'
-                HDB_URL_PREFIX + listing_url
-                if listing_url.startswith("/")
-                else listing_url
-                for listing_url in listing_urls
-            ]
-
-            logger.info(
-                f"Found {len(listing_urls)} listing URLs from page {page_index+1} of {HDB_URL_MAIN}"
-            )
-            writer.writerows([[listing_url] for listing_url in listing_urls])
+        writer.writerows([listing_url] for listing_url in all_listing_urls)
 
 
-async def _click_resale_listings_button(page, debug_logging_name):
-    # N/B: any 'h1' tag is a simple heuristic to determine that the Angular-rendered web page has loaded
-    logger.debug(f"Waiting page to load of {debug_logging_name}")
-    await page.waitForSelector("h1")
+def _normalize_listing_urls(listing_urls):
+    return [
+        # Many URLs are just encoded as '/home/resale/xxx' (and 'urljoin' leaves absolute URLs as-is)
+        urllib.parse.urljoin(HDB_URL_PREFIX, listing_url)
+        for listing_url in listing_urls
+        # N/B: 'urljoin' turns an empty (or missing) href into the prefix itself, i.e. the homepage
+        if listing_url
+    ]
+
 
+async def _click_resale_listings_button(page, debug_logging_name):
     logger.debug(f"Finding 'resale listings' button of {debug_logging_name}")
-    links = await page.querySelectorAll("a.flat-link")
-    links_for_resale_listings = [
-        link
-        for link in links
-        # Check for nested child element of the link to indicate 'resale'
-        if await link.querySelector(".tag-resale")
-    ]
-    assert len(links_for_resale_listings) == 1
-    link_for_resale_listings = links_for_resale_listings[0]
+    # N/B: filtering inside the browser takes a single round-trip, rather than one per link
+    link_for_resale_listings_handle = await page.evaluateHandle("""() => {
+            const linksForResaleListings = Array.from(
+                document.querySelectorAll("a.flat-link")
+            ).filter(
+                // Check for nested child element of the link to indicate 'resale'
+                link => link.querySelector(".tag-resale") !== null
+            );
+            return linksForResaleListings.length === 1 ? linksForResaleListings[0] : null;
+        }""")
+    link_for_resale_listings = link_for_resale_listings_handle.asElement()
+    assert link_for_resale_listings is not None
 
     logger.debug(f"Clicking 'resale listings' button of {debug_logging_name}")
     await link_for_resale_listings.click()
@@ -111,11 +123,28 @@ async def _click_next_page_button(page, debug_logging_name):
         logger.debug(f"Found disabled 'next page' button of {debug_logging_name}")
         return False
 
+    # N/B: the listing cards are re-rendered in place, so rather than waiting a fixed amount of time,
+    # we wait until the first listing card is no longer the one from the previous page
+    first_listing_card_text = await page.querySelectorEval(
+        ".listing-card", "card => card.textContent"
+    )
+
     logger.debug(f"Clicking on 'next page' button of {debug_logging_name}")
     await next_page_button.click()
     logger.debug(f"Waiting for 'next page' to reload of {debug_logging_name}")
-    await page.waitFor(NEXT_PAGE_WAIT_TIME_SECONDS * 1000)
-    await page.waitForSelector(".listing-card")
+    try:
+        await page.waitForFunction(
+            """previousText => {
+                const card = document.querySelector(".listing-card");
+                return card !== null && card.textContent !== previousText;
+            }""",
+            {"timeout": NEXT_PAGE_TIMEOUT_SECONDS * 1000},
+            first_listing_card_text,
+        )
+    except pyppeteer.errors.TimeoutError:
+        logger.warning(
+            f"First listing card did not change after clicking 'next page' of {debug_logging_name}, continuing anyway"
+        )
 
     return True
 
@@ -1,14 +1,51 @@
 # pylint: disable=import-error,missing-module-docstring,missing-class-docstring,missing-function-docstring,too-few-public-methods,too-many-instance-attributes,too-many-arguments,too-many-positional-arguments,too-many-locals,line-too-long,logging-fstring-interpolation,broad-exception-caught
 import dataclasses
 import datetime
+import itertools
 import logging
 import re
 import typing
-
+import bs4
+
+# N/B: compiled once at import, rather than on every call for every scraped listing
+POSTAL_CODE_PATTERN = re.compile(pattern=r"Singapore\s+(\d{6})")
+REMAINING_LEASE_PATTERN = re.compile(
+    pattern=r"(\d+)\s+years(\s+(\d+)\s+months)?", flags=re.IGNORECASE
+)
+LAST_UPDATED_PATTERN = re.compile(
+    pattern=r"Last\s+updated:\s*(\d+)\s+([a-zA-Z]+)\s+(\d+)", flags=re.IGNORECASE
+)
+# N/B: a plain lookup, since 'strptime' re-parses its format string (and takes a lock) on every call
+MONTH_NUMS_BY_NAME = {
+    month_name: month_num
+    for month_num, month_name in enumerate(
+        [
+            "january",
+            "february",
+            "march",
+            "april",
+            "may",
+            "june",
+            "july",
+            "august",
+            "september",
+            "october",
+            "november",
+            "december",
+        ],
+        start=1,
+    )
+}
+HEADER_DEBUG_LOGGING_NAMES_BY_TAG_TYPE = {
+    "h3": "address",
+    "h5": "sub-address",
+    "p": "subtitle",
+    "h2": "price",
+}
 logger = logging.getLogger(__name__)
 
 
-@dataclasses.dataclass
+@dataclasses.dataclass(frozen=True, slots=True)
 class HeaderInfo:
     address: typing.Any
     sub_address: typing.Any
@@ -20,30 +57,15 @@ class HeaderInfo:
 
 def parse_header_info(html_soup):
     logger.debug("*** Parsing header info ***")
-    address = _find_simple_text(
-        html_soup=html_soup,
-        tag_type="h3",
-        attr_regex=re.compile(pattern=r"_ngcontent-\w{3}-c7"),
-        debug_logging_name="address",
-    )
-    sub_address = _find_simple_text(
-        html_soup=html_soup,
-        tag_type="h5",
-        attr_regex=re.compile(pattern=r"_ngcontent-\w{3}-c7"),
-        debug_logging_name="sub-address",
-    )
-    subtitle = _find_simple_text(
+    simple_texts = _find_simple_texts(
         html_soup=html_soup,
-        tag_type="p",
-        attr_regex=re.compile(pattern=r"_ngcontent-\w{3}-c7"),
-        debug_logging_name="subtitle",
-    )
-    price = _find_simple_text(
-        html_soup=html_soup,
-        tag_type="h2",
-        attr_regex=re.compile(pattern=r"_ngcontent-\w{3}-c7"),
-        debug_logging_name="price",
+        debug_logging_names_by_tag_type=HEADER_DEBUG_LOGGING_NAMES_BY_TAG_TYPE,
+        attr_predicate=_is_ngcontent_c7_attr,
     )
+    address = simple_texts.get("address")
+    sub_address = simple_texts.get("sub-address")
+    subtitle = simple_texts.get("subtitle")
+    price = simple_texts.get("price")
     assert len(address) == 1
     assert len(sub_address) == 1
     assert len(subtitle) == 2
@@ -55,38 +77,77 @@ def parse_header_info(html_soup):
         sub_address=sub_address[0].strip(),
         postal_code=_parse_postal_code_from_sub_address(sub_address[0].strip()),
         hdb_type=subtitle[0].strip(),
-        area=float(subtitle[1][: -len("sqm")].strip()),
-        price=float(price[0][len("$") :].strip().replace(",", "")),
+        # N/B: 'float' already ignores surrounding whitespace, so there is no need to strip first
+        area=float(subtitle[1][:-3]),  # Without the trailing "sqm"
+        price=float(price[0][1:].replace(",", "")),  # Without the leading "$"
     )
 
 
-def _find_simple_text(html_soup, tag_type, attr_regex, debug_logging_name):
-    logger.debug(f"Starting to find simple text for {debug_logging_name}")
-    elements = html_soup.find_all(name=tag_type)
-    for element in elements:
-        logger.debug(f"Checking element for {debug_logging_name}: {element}")
-        if any(attr_regex.match(attr_keys) for attr_keys in element.attrs.keys()):
+# Returns a dict of debug logging name -> direct text contents of the first matching element of that tag type.
+# N/B: all tag types are looked for in a single walk of the tree, rather than one walk per tag type
+def _find_simple_texts(html_soup, debug_logging_names_by_tag_type, attr_predicate):
+    logger.debug(
+        f"Starting to find simple text for {', '.join(debug_logging_names_by_tag_type.values())}"
+    )
+    simple_texts = {}
+    # N/B: checked once up front, since formatting a tag for the debug logs serializes its whole subtree
+    is_debug_logging_enabled = logger.isEnabledFor(logging.DEBUG)
+    # N/B: walking the tree lazily (rather than 'find_all', which collects every matching tag first)
+    # means that we can stop as soon as all texts are found, which is usually near the top of the page
+    for element in html_soup.descendants:
+        debug_logging_name = debug_logging_names_by_tag_type.get(element.name)
+        if debug_logging_name is None or debug_logging_name in simple_texts:
+            continue
+        if is_debug_logging_enabled:
+            logger.debug(f"Checking element for {debug_logging_name}: {element}")
+        if any(attr_predicate(attr_key) for attr_key in element.attrs):
             contents = element.contents
-            logger.debug(f"Matched element for {debug_logging_name}! {contents}")
-            return _direct_text_contents(contents=contents)
-    logger.error(f"No matching elements for {debug_logging_name}!")
-    return None
+            if is_debug_logging_enabled:
+                logger.debug(f"Matched element for {debug_logging_name}! {contents}")
+            simple_texts[debug_logging_name] = _direct_text_contents(contents=contents)
+            if len(simple_texts) == len(debug_logging_names_by_tag_type):
+                break
+    for debug_logging_name in debug_logging_names_by_tag_type.values():
+        if debug_logging_name not in simple_texts:
+            logger.error(f"No matching elements for {debug_logging_name}!")
+    return simple_texts
+
+
+# Angular's scoped-style attributes look like '_ngcontent-xxx-c7';
+# N/B: plain string checks, since this runs against every attribute of every candidate tag
+def _is_ngcontent_c7_attr(attr_key):
+    return attr_key.startswith("_ngcontent-") and attr_key[14:17] == "-c7"
 
 
 def _direct_text_contents(contents):
-    return [content for content in contents if isinstance(content, str)]
+    return list(_iter_direct_text_contents(contents=contents))
+
+
+def _iter_direct_text_contents(contents):
+    return (content for content in contents if isinstance(content, str))
 
 
 def _parse_postal_code_from_sub_address(sub_address):
-    pattern = r"Singapore\s+(\d{6})"
-    match = re.search(pattern=pattern, string=sub_address)
+    # N/B: sub-addresses almost always end with e.g. "Singapore 123456",
+    # so plain string checks are tried before falling back to the regex
+    singapore_index = sub_address.find("Singapore")
+    if singapore_index != -1:
+        after_singapore = sub_address[singapore_index + len("Singapore") :]
+        postal_code = after_singapore.lstrip()[:6]
+        if (
+            after_singapore[:1].isspace()
+            and len(postal_code) == 6
+            and postal_code.isdecimal()
+        ):
+            return postal_code
+    match = POSTAL_CODE_PATTERN.search(sub_address)
     if match:
         return match.group(1)
     logger.error(f"Could not parse postal code from sub-address {sub_address}")
     return None
 
 
-@dataclasses.dataclass
+@dataclasses.dataclass(frozen=True, slots=True)
 class DetailsInfo:
     town: typing.Any
     storey_range: typing.Any
@@ -109,12 +170,29 @@ def parse_details_info(html_soup):
     logger.debug("*** Parsing details info ***")
     content_element = html_soup.find(id="content")
 
-    detail_elements = content_element.find_all(class_="col-6")
-    details = [
-        _parse_single_detail(detail_element) for detail_element in detail_elements
-    ]
+    # N/B: a single walk of the content subtree, rather than one 'find_all' walk per class
+    detail_elements = []
+    description_elements = []
+    last_updated_elements = []
+    for element in content_element.descendants:
+        if not isinstance(element, bs4.Tag):
+            continue
+        classes = element.get("class") or ()
+        if "col-6" in classes:
+            detail_elements.append(element)
+        if "col-10" in classes:
+            description_elements.append(element)
+        if "description-last-updated" in classes:
+            last_updated_elements.append(element)
+
+    # Keyed case-insensitively, so that each detail is a single lookup rather than a scan of all details
+    details_by_key = {}
+    for detail_element in detail_elements:
+        key, val = _parse_single_detail(detail_element)
+        # N/B: 'setdefault' keeps the first detail for each key, like scanning in order would
+        # N/B: an empty (or whitespace-only) last paragraph leaves a trailing ", " on the joined value
+        details_by_key.setdefault(key.lower(), val.strip())
 
-    description_elements = content_element.find_all(class_="col-10")
     assert len(description_elements) > 0
     description_elements = [
         nested_description_element
@@ -124,86 +202,93 @@ def parse_details_info(html_soup):
         )
     ]
     assert len(description_elements) > 0
-    logger.debug(f"Parsing description elements: {description_elements}")
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(f"Parsing description elements: {description_elements}")
     description = "\n".join(
-        [
-            text_content
+        itertools.chain.from_iterable(
+            _iter_direct_text_contents(contents=description_element)
             for description_element in description_elements
-            for text_content in _direct_text_contents(description_element)
-        ]
+        )
     )
 
-    last_updated_elements = content_element.find_all(class_="description-last-updated")
     assert len(last_updated_elements) > 0
-    logger.debug(f"Parsing last updated elements: {last_updated_elements}")
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(f"Parsing last updated elements: {last_updated_elements}")
     last_updated = ", ".join(
-        [
-            text_content
+        itertools.chain.from_iterable(
+            _iter_direct_text_contents(contents=last_updated_element)
             for last_updated_element in last_updated_elements
-            for text_content in _direct_text_contents(last_updated_element)
-        ]
+        )
     )
 
+    remaining_lease = _find_from_details(
+        details_by_key=details_by_key, key="Remaining lease"
+    )
     return DetailsInfo(
-        town=_find_from_details(details=details, key="Town"),
-        storey_range=_find_from_details(details=details, key="Storey range"),
-        remaining_lease=_find_from_details(details=details, key="Remaining lease"),
-        remaining_lease_num_years=_parse_remaining_lease_num_years(
-            _find_from_details(details=details, key="Remaining lease")
+        town=_find_from_details(details_by_key=details_by_key, key="Town"),
+        storey_range=_find_from_details(
+            details_by_key=details_by_key, key="Storey range"
         ),
+        remaining_lease=remaining_lease,
+        remaining_lease_num_years=_parse_remaining_lease_num_years(remaining_lease),
         num_bathrooms=int(
-            _find_from_details(details=details, key="Number of bathrooms")
+            _find_from_details(details_by_key=details_by_key, key="Number of bathrooms")
+        ),
+        num_bedrooms=int(
+            _find_from_details(details_by_key=details_by_key, key="Number of bedrooms")
         ),
-        num_bedrooms=int(_find_from_details(details=details, key="Number of bedrooms")),
-        balcony=_find_from_details(details=details, key="Balcony"),
-        contra=_find_from_details(details=details, key="Contra"),
-        extension_of_stay=_find_from_details(details=details, key="Extension of stay"),
-        upgrading=_find_from_details(details=details, key="Upgrading"),
+        balcony=_find_from_details(details_by_key=details_by_key, key="Balcony"),
+        contra=_find_from_details(details_by_key=details_by_key, key="Contra"),
+        extension_of_stay=_find_from_details(
+            details_by_key=details_by_key, key="Extension of stay"
+        ),
+        upgrading=_find_from_details(details_by_key=details_by_key, key="Upgrading"),
         ethnic_eligibility=_find_from_details(
-            details=details, key="Ethnic eligibility"
+            details_by_key=details_by_key, key="Ethnic eligibility"
+        ),
+        spr_eligibility=_find_from_details(
+            details_by_key=details_by_key, key="SPR eligibility"
         ),
-        spr_eligibility=_find_from_details(details=details, key="SPR eligibility"),
         description=description,
         last_updated=last_updated,
         last_updated_date=_parse_last_updated_date(last_updated=last_updated),
     )
 
 
-@dataclasses.dataclass
-class SingleDetail:
-    key: typing.Any
-    val: typing.Any
-
-
+# Returns a (key, val) tuple, since it is only ever unpacked straight into 'details_by_key'
 def _parse_single_detail(element):
-    logger.debug(f"Parsing single detail: {element}")
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(f"Parsing single detail: {element}")
+
+    # N/B: a single walk for both tag types, rather than one 'find_all' walk each
+    spans = []
+    paragraphs = []
+    for child in element.find_all(["span", "p"]):
+        (spans if child.name == "span" else paragraphs).append(child)
 
-    spans = element.find_all("span")
     assert len(spans) == 1
     assert len(spans[0].contents) == 1
     key = spans[0].contents[0].strip()
 
-    paragraphs = element.find_all("p")
     assert len(paragraphs) > 0
     for paragraph in paragraphs:
         assert len(paragraph.contents) > 0
-    val = ", ".join([paragraph.contents[-1].strip() for paragraph in paragraphs])
+    val = ", ".join(paragraph.contents[-1].strip() for paragraph in paragraphs)
 
     logger.debug(f"Parsed single detail to be {key} = {val}")
-    return SingleDetail(key=key, val=val)
+    return key, val
 
 
-def _find_from_details(details, key):
-    for detail in details:
-        if detail.key.lower() == key.lower():
-            return detail.val.strip()
+def _find_from_details(details_by_key, key):
+    val = details_by_key.get(key.lower())
+    if val is not None:
+        return val
     logger.error(f"Could not find {key} in details")
     return None
 
 
 def _parse_remaining_lease_num_years(remaining_lease):
-    pattern = r"(\d+)\s+years(\s+(\d+)\s+months)?"
-    match = re.search(pattern=pattern, string=remaining_lease, flags=re.IGNORECASE)
+    match = REMAINING_LEASE_PATTERN.search(remaining_lease)
     if match:
         years = int(match.group(1))
         months = int(match.group(3)) if match.group(3) else 0
@@ -213,17 +298,19 @@ def _parse_remaining_lease_num_years(remaining_lease):
 
 
 def _parse_last_updated_date(last_updated):
-    pattern = r"Last\s+updated:\s*(\d+)\s+([a-zA-Z]+)\s+(\d+)"
-    matches = re.findall(pattern=pattern, string=last_updated, flags=re.IGNORECASE)
-    assert len(matches) > 0
-    last_updated_date = max(
+    # N/B: (year, month, day) tuples compare the same way as the dates themselves,
+    # so only the latest one needs to be turned into a date;
+    # and 'finditer' lets us take the latest as we go, without first collecting every match
+    latest_year_month_day = max(
         (
-            datetime.datetime(
-                year=int(year),
-                month=datetime.datetime.strptime(month, "%B").month,
-                day=int(day),
+            (int(year), MONTH_NUMS_BY_NAME[month.lower()], int(day))
+            for day, month, year in (
+                match.groups() for match in LAST_UPDATED_PATTERN.finditer(last_updated)
             )
-            for day, month, year in matches
-        )
+        ),
+        default=None,
     )
+    assert latest_year_month_day is not None
+    year, month, day = latest_year_month_day
+    last_updated_date = datetime.datetime(year=year, month=month, day=day)
     return last_updated_date.strftime("%Y-%m-%d")
@@ -3,11 +3,14 @@ import argparse
 import csv
 import dataclasses
 import logging
+import math
 import os
 import typing
 import file_util
 import gmaps_util
 
+# Postal codes are looked up (and their rows written out) this many at a time
+POSTAL_CODES_PER_CHUNK = 50
 logger = logging.getLogger(__name__)
 
 
@@ -18,7 +21,7 @@ def _full_results_with_mrt_info():
 
     output_file_exists, already_processed_urls = _get_already_processed_urls()
     gmaps = gmaps_util.get_gmaps_client()
-    mrt_station_map = _get_mrt_station_map_from_file()
+    mrt_stations = _get_mrt_stations_from_file()
 
     with open(
         os.path.join(file_util.OUTPUT_FOLDER, file_util.BASE_INFO_FILENAME),
@@ -30,73 +33,95 @@ def _full_results_with_mrt_info():
         newline="",
         encoding="utf-8",
     ) as full_results_file:
-        base_info_dict_reader = csv.DictReader(base_info_file)
         full_results_writer = csv.writer(full_results_file)
 
         if not output_file_exists:
             _write_full_results_headers(full_results_writer=full_results_writer)
 
-        # Sorting allows us to 'cache' the results of postal code lookups,
-        # without the overhead of keeping an entire dictionary
-        # of postal code -> nearest MRT info in memory
-        listing_dicts = sorted(
-            list(base_info_dict_reader), key=lambda row: row["Postal code"]
-        )
-        num_listings = len(listing_dicts)
-        num_written = 0
-        prev_postal_code = None
-        prev_postal_code_nearest_mrt_info = None
-        for listing_index, listing_dict in enumerate(listing_dicts):
-            assert "Link" in listing_dict and listing_dict["Link"]
-            listing_url = listing_dict["Link"]
-            debug_logging_name = (
-                f"{listing_url} (listing #{listing_index+1} of {num_listings})"
-            )
-
-            if listing_url in already_processed_urls:
+        # N/B: the base info is streamed once to count it, once to find the pending postal codes,
+        # and once more for each chunk to pick out that chunk's rows; so only the keys
+        # (rather than all listings) are held in memory for the whole run, along with one chunk's rows at a time
+        num_listings = sum(1 for _ in csv.DictReader(base_info_file))
+        pending_postal_codes = set()
+        for listing_dict, debug_logging_name in _iter_base_info_listings(
+            base_info_file=base_info_file, num_listings=num_listings
+        ):
+            if listing_dict["Link"] in already_processed_urls:
                 logger.info(
                     f"Skipping {debug_logging_name} because it is already processed"
                 )
                 continue
 
             assert "Postal code" in listing_dict and listing_dict["Postal code"]
-            postal_code = listing_dict["Postal code"]
-            if prev_postal_code is not None and postal_code == prev_postal_code:
-                logger.info(
-                    f"Cache hit for nearest MRT info for 'S{postal_code}' for {debug_logging_name}"
-                )
-                nearest_mrt_info = prev_postal_code_nearest_mrt_info
-            else:
-                nearest_mrt_info = _get_nearest_mrt_info(
-                    postal_code=postal_code,
-                    debug_logging_name=debug_logging_name,
-                    gmaps=gmaps,
-                    mrt_station_map=mrt_station_map,
-                )
+            pending_postal_codes.add(listing_dict["Postal code"])
 
-            if nearest_mrt_info is None:
-                logger.warning(
-                    f"Skipping {debug_logging_name} because we could not obtain nearest MRT info"
-                )
-                continue
+        # Sorting keeps listings with the same postal code next to each other in the output;
+        # N/B: postal codes are sorted as strings, which is already numeric order for the fixed-width six-digit codes,
+        # and (unlike 'int') does not crash on a postal code that failed to parse (written as 'None')
+        postal_codes = sorted(pending_postal_codes)
 
-            _write_full_results_row(
-                full_results_writer=full_results_writer,
-                listing_dict=listing_dict,
-                nearest_mrt_info=nearest_mrt_info,
+        num_written = 0
+        # Each unique postal code is looked up once, in batches, rather than one listing at a time;
+        # N/B: a chunk's rows are forced onto the disk before the next chunk is looked up,
+        # so a failure midway still keeps every row written so far (and a rerun resumes from there)
+        for chunk_start in range(0, len(postal_codes), POSTAL_CODES_PER_CHUNK):
+            chunk_postal_codes = postal_codes[
+                chunk_start : chunk_start + POSTAL_CODES_PER_CHUNK
+            ]
+            nearest_mrt_infos = _get_nearest_mrt_infos(
+                postal_codes=chunk_postal_codes,
+                gmaps=gmaps,
+                mrt_stations=mrt_stations,
             )
-            num_written += 1
-            base_info_file.flush()
-            os.fsync(base_info_file.fileno())
 
-            prev_postal_code = postal_code
-            prev_postal_code_nearest_mrt_info = nearest_mrt_info
+            chunk_listings_by_postal_code = {}
+            for listing_dict, debug_logging_name in _iter_base_info_listings(
+                base_info_file=base_info_file, num_listings=num_listings
+            ):
+                if (
+                    listing_dict["Postal code"] in nearest_mrt_infos
+                    and listing_dict["Link"] not in already_processed_urls
+                ):
+                    chunk_listings_by_postal_code.setdefault(
+                        listing_dict["Postal code"], []
+                    ).append((listing_dict, debug_logging_name))
+
+            for postal_code in chunk_postal_codes:
+                nearest_mrt_info = nearest_mrt_infos[postal_code]
+                for listing_dict, debug_logging_name in chunk_listings_by_postal_code[
+                    postal_code
+                ]:
+                    if nearest_mrt_info is None:
+                        logger.warning(
+                            f"Skipping {debug_logging_name} because we could not obtain nearest MRT info"
+                        )
+                        continue
+
+                    _write_full_results_row(
+                        full_results_writer=full_results_writer,
+                        listing_dict=listing_dict,
+                        nearest_mrt_info=nearest_mrt_info,
+                    )
+                    num_written += 1
+
+            full_results_file.flush()
+            os.fsync(full_results_file.fileno())
 
         logger.info(
             f"Successfully exported {num_written} scraped results to {file_util.FULL_RESULTS_FILENAME}"
         )
 
 
+# Yields (listing dict, debug logging name) for each listing, from the start of the base info file
+def _iter_base_info_listings(base_info_file, num_listings):
+    base_info_file.seek(0)
+    for listing_index, listing_dict in enumerate(csv.DictReader(base_info_file)):
+        assert "Link" in listing_dict and listing_dict["Link"]
+        yield listing_dict, (
+            f"{listing_dict['Link']} (listing #{listing_index+1} of {num_listings})"
+        )
+
+
 def _get_already_processed_urls():
     logger.debug(
         f"Getting already-processed listings from {file_util.FULL_RESULTS_FILENAME}"
@@ -105,29 +130,49 @@ def _get_already_processed_urls():
         os.path.join(file_util.OUTPUT_FOLDER, file_util.FULL_RESULTS_FILENAME)
     ):
         logger.debug(f"{file_util.FULL_RESULTS_FILENAME} does not exist yet!")
-        return False, {}
+        return False, set()
     with open(
         os.path.join(file_util.OUTPUT_FOLDER, file_util.FULL_RESULTS_FILENAME),
         newline="",
         encoding="utf-8",
     ) as full_results_file:
-        dict_reader = csv.DictReader(full_results_file)
-        already_processed_urls = set(row["Link"] for row in dict_reader)
+        # N/B: "Link" is always the first column, so there's no need to build a dict for every row
+        reader = csv.reader(full_results_file)
+        next(reader, None)  # Skip the headers
+        already_processed_urls = {row[0] for row in reader}
         logger.info(f"{len(already_processed_urls)} already-processed listings found!")
         return True, already_processed_urls
 
 
-def _get_mrt_station_map_from_file():
+@dataclasses.dataclass
+class MRTStations:
+    names: typing.Any
+    lat_rads: typing.Any
+    lon_rads: typing.Any
+    cos_lats: typing.Any
+
+
+def _get_mrt_stations_from_file():
     with open(
         os.path.join(file_util.OUTPUT_FOLDER, file_util.PRECOMPUTE_FILENAME),
         newline="",
         encoding="utf-8",
     ) as mrt_precompute_file:
         reader = csv.reader(mrt_precompute_file)
-        return {row[0]: (float(row[1]), float(row[2])) for row in reader}
+        rows = list(reader)
+        # Kept as parallel lists, so that distances to all MRT stations can be computed in one go;
+        # N/B: and already in radians (with the cosines of the latitudes),
+        # since the same MRT stations are compared against every postal code
+        lat_rads = [math.radians(float(row[1])) for row in rows]
+        return MRTStations(
+            names=[row[0] for row in rows],
+            lat_rads=lat_rads,
+            lon_rads=[math.radians(float(row[2])) for row in rows],
+            cos_lats=[math.cos(lat_rad) for lat_rad in lat_rads],
+        )
 
 
-@dataclasses.dataclass
+@dataclasses.dataclass(frozen=True, slots=True)
 class NearestMRTInfo:
     nearest_mrt_station: typing.Any
     straight_line_distance_km: typing.Any
@@ -135,56 +180,75 @@ class NearestMRTInfo:
     walking_duration_mins: typing.Any
 
 
-def _get_nearest_mrt_info(postal_code, debug_logging_name, gmaps, mrt_station_map):
-    logger.info(
-        f"Finding nearest MRT info for 'S{postal_code}' for {debug_logging_name}"
-    )
+# Returns a dict of postal code -> nearest MRT info (or None if it could not be obtained)
+def _get_nearest_mrt_infos(postal_codes, gmaps, mrt_stations):
+    logger.info(f"Finding nearest MRT info for {len(postal_codes)} postal codes")
 
-    postal_code_address = f"{postal_code}, Singapore"
-    postal_code_lat, postal_code_lon = gmaps_util.get_lat_lon_from_address(
-        gmaps=gmaps, address=postal_code_address
+    postal_code_addresses = [
+        f"{postal_code}, Singapore" for postal_code in postal_codes
+    ]
+    postal_code_lat_lons = gmaps_util.get_lat_lon_from_addresses(
+        gmaps=gmaps, addresses=postal_code_addresses
     )
 
-    mrt_station_distances_km = [
-        (
-            mrt_station,
-            gmaps_util.haversine_distance_km(
+    nearest_mrt_stations = {}
+    for postal_code, (postal_code_lat, postal_code_lon) in zip(
+        postal_codes, postal_code_lat_lons
+    ):
+        nearest_mrt_station_index, nearest_mrt_station_distance_km = (
+            gmaps_util.nearest_haversine_distance_km_from_radians(
                 lat1=postal_code_lat,
                 lon1=postal_code_lon,
-                lat2=mrt_station_lat,
-                lon2=mrt_station_lon,
-            ),
+                lat2_rads=mrt_stations.lat_rads,
+                lon2_rads=mrt_stations.lon_rads,
+                cos_lat2s=mrt_stations.cos_lats,
+            )
+        )
+        nearest_mrt_stations[postal_code] = (
+            mrt_stations.names[nearest_mrt_station_index],
+            nearest_mrt_station_distance_km,
+        )
+        logger.debug(
+            f"Computed that closest MRT to 'S{postal_code}' is {nearest_mrt_stations[postal_code][0]}"
         )
-        for mrt_station, (mrt_station_lat, mrt_station_lon) in mrt_station_map.items()
-    ]
-    nearest_mrt_station, nearest_mrt_station_distance_km = min(
-        mrt_station_distances_km, key=lambda x: x[1]
-    )
-    logger.debug(
-        f"Computed that closest MRT to 'S{postal_code}' is {nearest_mrt_station}"
-    )
 
-    distance_metres, duration_seconds = gmaps_util.get_walking_distance_and_duration(
+    walking_distances_and_durations = gmaps_util.get_walking_distances_and_durations(
         gmaps=gmaps,
-        start=postal_code_address,
-        end=nearest_mrt_station,
+        starts_and_ends=[
+            (postal_code_address, nearest_mrt_stations[postal_code][0])
+            for postal_code, postal_code_address in zip(
+                postal_codes, postal_code_addresses
+            )
+        ],
     )
-    if distance_metres is not None and duration_seconds is not None:
-        logger.debug(
-            f"Google Maps says that 'S{postal_code}' to {nearest_mrt_station} takes {(duration_seconds / 60):.2f}mins"
-        )
-    else:
-        logger.warning(
-            f"Google Maps unable to find walking distance from 'S{postal_code}' to {nearest_mrt_station}"
+
+    nearest_mrt_infos = {}
+    for postal_code, postal_code_address in zip(postal_codes, postal_code_addresses):
+        nearest_mrt_station, nearest_mrt_station_distance_km = nearest_mrt_stations[
+            postal_code
+        ]
+        distance_metres, duration_seconds = walking_distances_and_durations[
+            (postal_code_address, nearest_mrt_station)
+        ]
+        if distance_metres is not None and duration_seconds is not None:
+            logger.debug(
+                f"Google Maps says that 'S{postal_code}' to {nearest_mrt_station} takes {(duration_seconds / 60):.2f}mins"
+            )
+        else:
+            logger.warning(
+                f"Google Maps unable to find walking distance from 'S{postal_code}' to {nearest_mrt_station}"
+            )
+            nearest_mrt_infos[postal_code] = None
+            continue
+
+        nearest_mrt_infos[postal_code] = NearestMRTInfo(
+            nearest_mrt_station=nearest_mrt_station,
+            straight_line_distance_km=nearest_mrt_station_distance_km,
+            walking_distance_km=distance_metres / 1000,
+            walking_duration_mins=duration_seconds / 60,
         )
-        return None
 
-    return NearestMRTInfo(
-        nearest_mrt_station=nearest_mrt_station,
-        straight_line_distance_km=nearest_mrt_station_distance_km,
-        walking_distance_km=distance_metres / 1000,
-        walking_duration_mins=duration_seconds / 60,
-    )
+    return nearest_mrt_infos
 
 
 def _write_full_results_headers(full_results_writer):
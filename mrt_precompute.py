@@ -25,7 +25,7 @@ def _get_all_mrt_station_names():
     # each with a link to the dedicated page for the MRT station,
     # with italicized names being 'future' stations (and are thus excluded);
     # this italic <i> tag can be either INSIDE or OUTSIDE the <a> tag, for some reason...
-    html_soup = bs4.BeautifulSoup(response.text, "html.parser")
+    html_soup = bs4.BeautifulSoup(response.text, "lxml")
     all_mrt_station_names = set()
     all_tables = html_soup.find_all("table", class_="wikitable sortable")
     for table in all_tables:
@@ -61,10 +61,15 @@ def _precompute_mrt_station_map(all_mrt_station_names):
         encoding="utf-8",
     ) as csvfile:
         writer = csv.writer(csvfile)
-        for mrt_station_name in all_mrt_station_names:
-            lat_lon = gmaps_util.get_lat_lon_from_address(
-                gmaps=gmaps, address=f"{mrt_station_name}, Singapore"
-            )
+        all_mrt_station_names = list(all_mrt_station_names)
+        lat_lons = gmaps_util.get_lat_lon_from_addresses(
+            gmaps=gmaps,
+            addresses=[
+                f"{mrt_station_name}, Singapore"
+                for mrt_station_name in all_mrt_station_names
+            ],
+        )
+        for mrt_station_name, lat_lon in zip(all_mrt_station_names, lat_lons):
             logger.debug(f"{mrt_station_name} is at {lat_lon}")
             writer.writerow([mrt_station_name, *lat_lon])
 
@@ -18,12 +18,15 @@ RETRY_DELAY_SECONDS = 5
 MAX_ATTEMPTS_FOR_NETWORK_ERROR = 5
 MAX_ATTEMPTS_FOR_OTHER_ERROR = 3
 MAX_ATTEMPTS_FOR_CLOUDFLARE_WAIT = 5
+FSYNC_EVERY_NUM_ROWS = 25
 MRT_DISTANCE_PATTERN = r"^([\d.]+) (m|km) \((\d+) mins\) from ([A-Z]+\d+) .+$"
-LISTING_PATTERN = r"^https://www\.propertyguru\.com\.sg/listing/(?:.*-)?(\d+)$"
+LISTING_PATTERN = re.compile(
+    pattern=r"^https://www\.propertyguru\.com\.sg/listing/(?:.*-)?(\d+)$"
+)
 logger = logging.getLogger(__name__)
 
 
-async def _scrape_listings():
+async def _scrape_listings(use_browser_profile):
     logger.info(
         f"Starting to scrape all listings from {file_util.PG_LISTINGS_FILENAME}"
     )
@@ -35,6 +38,13 @@ async def _scrape_listings():
         max_attempts_for_network_error=MAX_ATTEMPTS_FOR_NETWORK_ERROR,
         max_attempts_for_other_error=MAX_ATTEMPTS_FOR_OTHER_ERROR,
         user_agent=browser_util.FAKE_USER_AGENT,
+        # N/B: everything we need is in the DOM (and its embedded JSON), so nothing here relies on CSS
+        blocked_resource_types=browser_util.DEFAULT_BLOCKED_RESOURCE_TYPES,
+        user_data_dir=(
+            os.path.join(file_util.OUTPUT_FOLDER, file_util.PG_BROWSER_PROFILE_FOLDER)
+            if use_browser_profile
+            else None
+        ),
     )
 
     with open(
@@ -53,47 +63,60 @@ async def _scrape_listings():
         if not output_file_exists:
             _write_full_results_headers(full_results_writer=full_results_writer)
 
-        listing_urls = list(listings_reader)
-        num_listings = len(listing_urls)
+        # Count first, then stream the listings, rather than holding all of them in memory
+        num_listings = sum(1 for _ in listings_reader)
+        listings_file.seek(0)
+        listings_reader = csv.reader(listings_file)
         num_already_exists = 0
         num_skipped = 0
         num_written = 0
-        for listing_index, listing_row in enumerate(listing_urls):
-            assert len(listing_row) == 1
-            listing_url = listing_row[0]
-            debug_logging_name = (
-                f"{listing_url} (listing #{listing_index+1} of {num_listings})"
-            )
-
-            if listing_url in already_processed_urls:
-                logger.info(
-                    f"Skipping {debug_logging_name} because it is already processed"
+        num_written_since_fsync = 0
+        try:
+            for listing_index, listing_row in enumerate(listings_reader):
+                (listing_url,) = listing_row
+                debug_logging_name = (
+                    f"{listing_url} (listing #{listing_index+1} of {num_listings})"
                 )
-                num_already_exists += 1
-                continue
 
-            listing_info = await _scrape_single_listing(
-                listing_url=listing_url,
-                debug_logging_name=debug_logging_name,
-                browser=browser,
-            )
-            if listing_info is None:
-                logger.warning(
-                    f"Unable to scrape {debug_logging_name}, skipping writing to {file_util.PG_FULL_RESULTS_FILENAME}"
+                if listing_url in already_processed_urls:
+                    logger.info(
+                        f"Skipping {debug_logging_name} because it is already processed"
+                    )
+                    num_already_exists += 1
+                    continue
+
+                listing_info = await _scrape_single_listing(
+                    listing_url=listing_url,
+                    debug_logging_name=debug_logging_name,
+                    browser=browser,
+                )
+                if listing_info is None:
+                    logger.warning(
+                        f"Unable to scrape {debug_logging_name}, skipping writing to {file_util.PG_FULL_RESULTS_FILENAME}"
+                    )
+                    num_skipped += 1
+                    continue
+
+                _write_full_results_row(
+                    full_results_writer=full_results_writer, listing_info=listing_info
                 )
-                num_skipped += 1
-                continue
+                num_written += 1
+                num_written_since_fsync += 1
 
-            _write_full_results_row(
-                full_results_writer=full_results_writer, listing_info=listing_info
-            )
-            num_written += 1
+                # Every row is flushed to the OS as soon as it is written,
+                # but only forced onto the disk every so often, since 'fsync' is slow
+                full_results_file.flush()
+                if num_written_since_fsync >= FSYNC_EVERY_NUM_ROWS:
+                    os.fsync(full_results_file.fileno())
+                    num_written_since_fsync = 0
+
+                # Artificially make this slower so HDB doesn't block us... :)
+                await asyncio.sleep(DELAY_PER_LISTING_LOAD_SECONDS)
+
+        finally:
             full_results_file.flush()
             os.fsync(full_results_file.fileno())
 
-            # Artificially make this slower so HDB doesn't block us... :)
-            await asyncio.sleep(DELAY_PER_LISTING_LOAD_SECONDS)
-
         logger.info(
             f"Successfully exported {num_written} scraped results to {file_util.PG_FULL_RESULTS_FILENAME}"
         )
@@ -112,14 +135,16 @@ def _get_already_processed_urls():
         os.path.join(file_util.OUTPUT_FOLDER, file_util.PG_FULL_RESULTS_FILENAME)
     ):
         logger.debug(f"{file_util.PG_FULL_RESULTS_FILENAME} does not exist yet!")
-        return False, {}
+        return False, set()
     with open(
         os.path.join(file_util.OUTPUT_FOLDER, file_util.PG_FULL_RESULTS_FILENAME),
         newline="",
         encoding="utf-8",
     ) as full_results_file:
-        dict_reader = csv.DictReader(full_results_file)
-        already_processed_urls = set(row["Link"] for row in dict_reader)
+        # N/B: "Link" is always the first column, so there's no need to build a dict for every row
+        reader = csv.reader(full_results_file)
+        next(reader, None)  # Skip the headers
+        already_processed_urls = {row[0] for row in reader}
         logger.info(f"{len(already_processed_urls)} already-processed listings found!")
         return True, already_processed_urls
 
@@ -145,7 +170,7 @@ async def _scrape_single_listing(
         return None
 
     logger.debug(f"Parsing HTML of {debug_logging_name}")
-    html_soup = bs4.BeautifulSoup(html, "html.parser")
+    html_soup = bs4.BeautifulSoup(html, "lxml")
 
     # Somewhat helpfully, this element already contains all the semantic data that is used
     # to populate the UI of the website, in a huge JSON blob.
@@ -212,7 +237,7 @@ def _get_validate_after_navigate(listing_url, debug_logging_name):
 
 
 def _parse_and_normalize_listing(link):
-    match = re.search(LISTING_PATTERN, link)
+    match = LISTING_PATTERN.search(link)
     if match is None:
         return None
     return f"https://www.propertyguru.com.sg/listing/{match.group(1)}"
@@ -274,13 +299,17 @@ def _write_full_results_row(full_results_writer, listing_info):
             listing_info.header_info.area_sqft / 10.764,
             listing_info.header_info.price,
             listing_info.details_info.floor_level,
-            99 - (datetime.datetime.now().year - listing_info.details_info.top_year)
-            if listing_info.details_info.top_year is not None
-            else None,
+            (
+                99 - (datetime.datetime.now().year - listing_info.details_info.top_year)
+                if listing_info.details_info.top_year is not None
+                else None
+            ),
             listing_info.details_info.nearest_mrt_name,
-            listing_info.details_info.nearest_mrt_duration_seconds / 60
-            if listing_info.details_info.nearest_mrt_duration_seconds is not None
-            else None,
+            (
+                listing_info.details_info.nearest_mrt_duration_seconds / 60
+                if listing_info.details_info.nearest_mrt_duration_seconds is not None
+                else None
+            ),
             listing_info.details_info.listed_date,
             listing_info.details_info.description_subtitle,
             listing_info.details_info.description_details,
@@ -291,9 +320,11 @@ def _write_full_results_row(full_results_writer, listing_info):
             listing_info.header_info.num_bathrooms,
             listing_info.details_info.furnished_status,
             listing_info.details_info.tenanted_status,
-            listing_info.details_info.nearest_mrt_distance_metres / 1000
-            if listing_info.details_info.nearest_mrt_distance_metres is not None
-            else None,
+            (
+                listing_info.details_info.nearest_mrt_distance_metres / 1000
+                if listing_info.details_info.nearest_mrt_distance_metres is not None
+                else None
+            ),
             listing_info.extra_info.main_image,
             # Mostly irrelevant info
             listing_info.header_info.title,
@@ -322,6 +353,11 @@ def main():
         choices=["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"],
         help="Set the logging level (default: INFO)",
     )
+    parser.add_argument(
+        "--browser_profile",
+        action="store_true",
+        help=f"Keep a persistent browser profile in {file_util.OUTPUT_FOLDER}/{file_util.PG_BROWSER_PROFILE_FOLDER} across runs, rather than using throwaway incognito pages",
+    )
     args = parser.parse_args()
     logging.basicConfig(
         level=args.log_level,
@@ -330,7 +366,7 @@ def main():
     )
 
     file_util.maybe_create_output_folder()
-    asyncio.run(_scrape_listings())
+    asyncio.run(_scrape_listings(use_browser_profile=args.browser_profile))
 
 
 if __name__ == "__main__":
@@ -7,6 +7,7 @@ import os
 import re
 import sys
 import bs4
+import lxml.html
 import browser_util
 import file_util
 
@@ -22,7 +23,10 @@ SINGLE_BROWSER_RUN_TIMEOUT_SECONDS = 5 * 60
 RETRY_DELAY_SECONDS = 5
 MAX_ATTEMPTS_FOR_NETWORK_ERROR = 5
 MAX_ATTEMPTS_FOR_OTHER_ERROR = 3
-LISTING_PATTERN = r"^https://www\.propertyguru\.com\.sg/listing/(?:.*-)?(\d+)$"
+LISTING_PATTERN = re.compile(
+    pattern=r"^https://www\.propertyguru\.com\.sg/listing/(?:.*-)?(\d+)$"
+)
+LISTING_CARD_LINK_HREFS_XPATH = "//a[contains(concat(' ', normalize-space(@class), ' '), ' listing-card-link ')]/@href"
 logger = logging.getLogger(__name__)
 
 
@@ -74,7 +78,7 @@ async def _get_num_pages(browser, base_page):
     )
 
     logger.debug(f"Parsing HTML of the first main page of {base_page}")
-    html_soup = bs4.BeautifulSoup(html, "html.parser")
+    html_soup = bs4.BeautifulSoup(html, "lxml")
     pagination_bar = html_soup.find("ul", {"class": "hui-pagination"})
     pagination_links = pagination_bar.find_all("a", class_="page-link")
 
@@ -103,10 +107,12 @@ async def _get_listing_urls_from_page(browser, page_url):
     )
 
     logger.debug(f"Parsing HTML of {page_url}")
-    html_soup = bs4.BeautifulSoup(html, "html.parser")
+    # N/B: querying 'lxml' directly avoids building Python objects for the (many) non-matching nodes
     listing_urls = [
-        _parse_and_normalize_listing(link=listing_link["href"])
-        for listing_link in html_soup.find_all("a", class_="listing-card-link")
+        _parse_and_normalize_listing(link=listing_link_href)
+        for listing_link_href in lxml.html.fromstring(html).xpath(
+            LISTING_CARD_LINK_HREFS_XPATH
+        )
     ]
 
     logger.info(f"Found {len(listing_urls)} listing URLs from {page_url}")
@@ -114,7 +120,7 @@ async def _get_listing_urls_from_page(browser, page_url):
 
 
 def _parse_and_normalize_listing(link):
-    match = re.search(LISTING_PATTERN, link)
+    match = LISTING_PATTERN.search(link)
     if match is None:
         logger.error(
             f"Link {link} did not match the listing pattern; this should not be possible; exiting!"
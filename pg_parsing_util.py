@@ -7,10 +7,35 @@ import re
 import typing
 
 PROPERTY_GURU_BASE_URL = "https://www.propertyguru.com.sg"
-TOP_YEAR_PATTERN = r"^TOP in( [a-zA-Z]+)? (\d+)$"
-LISTING_ID_PATTERN = r"^Listing ID - \d+$"
-LISTED_DATE_PATTERN = r"^Listed on\s+(\d+)\s+([a-zA-Z]+)\s+(\d+)$"
+# N/B: compiled once at import, rather than looked up in the 're' module's cache on every call
+TOP_YEAR_PATTERN = re.compile(pattern=r"^TOP in( [a-zA-Z]+)? (\d+)$")
+LISTING_ID_PATTERN = re.compile(pattern=r"^Listing ID - \d+$")
+LISTED_DATE_PATTERN = re.compile(pattern=r"^Listed on\s+(\d+)\s+([a-zA-Z]+)\s+(\d+)$")
+BR_TAG_PATTERN = re.compile(pattern=r"<br\s*/?>", flags=re.IGNORECASE)
+SPAN_TAG_PATTERN = re.compile(pattern=r"\s*<span[^>]*>.*?</span>\s*", flags=re.DOTALL)
+REPEATED_BLANK_LINES_PATTERN = re.compile(pattern=r"\n\s*\n+")
 SINGAPORE_TIMEZONE = datetime.timezone(datetime.timedelta(hours=8))
+# N/B: a plain lookup, since 'strptime' re-parses its format string (and takes a lock) on every call
+MONTH_NUMS_BY_ABBREVIATION = {
+    month_abbreviation: month_num
+    for month_num, month_abbreviation in enumerate(
+        [
+            "jan",
+            "feb",
+            "mar",
+            "apr",
+            "may",
+            "jun",
+            "jul",
+            "aug",
+            "sep",
+            "oct",
+            "nov",
+            "dec",
+        ],
+        start=1,
+    )
+}
 logger = logging.getLogger(__name__)
 
 
@@ -204,12 +229,12 @@ def _parse_room_and_area_data(items, listing_url):
             f"Did not find an 'area' items within 'amenities' for {listing_url}"
         )
     return RoomAndAreaData(
-        num_bedrooms=text_to_num(bedrooms_item["value"])
-        if bedrooms_item is not None
-        else None,
-        num_bathrooms=text_to_num(bathrooms_item["value"])
-        if bathrooms_item is not None
-        else None,
+        num_bedrooms=(
+            text_to_num(bedrooms_item["value"]) if bedrooms_item is not None else None
+        ),
+        num_bathrooms=(
+            text_to_num(bathrooms_item["value"]) if bathrooms_item is not None else None
+        ),
         area_sqft=text_to_num(area_item["value"]) if area_item is not None else None,
     )
 
@@ -314,49 +339,51 @@ def _parse_metatable_details_data(items, listing_data, listing_url):
         logger.warning(f"Found a non-HDB unit at {listing_url}")
 
     return MetatableDetailsData(
-        furnished_status=furnished_status_item["value"]
-        if furnished_status_item is not None
-        else None,
-        top_year=_parse_top_year(
-            year_text=top_year_item["value"], listing_url=listing_url
-        )
-        if top_year_item is not None
-        else None,
-        listed_date=_parse_listed_date(
-            listed_date_text=listed_date_item["value"],
-            listing_data=listing_data,
-            listing_url=listing_url,
-        )
-        if listed_date_item is not None
-        else None,
-        tenanted_status=tenanted_status_item["value"]
-        if tenanted_status_item is not None
-        else None,
+        furnished_status=(
+            furnished_status_item["value"]
+            if furnished_status_item is not None
+            else None
+        ),
+        top_year=(
+            _parse_top_year(year_text=top_year_item["value"], listing_url=listing_url)
+            if top_year_item is not None
+            else None
+        ),
+        listed_date=(
+            _parse_listed_date(
+                listed_date_text=listed_date_item["value"],
+                listing_data=listing_data,
+                listing_url=listing_url,
+            )
+            if listed_date_item is not None
+            else None
+        ),
+        tenanted_status=(
+            tenanted_status_item["value"] if tenanted_status_item is not None else None
+        ),
         floor_level=floor_level_item["value"] if floor_level_item is not None else None,
     )
 
 
 def _clean_description_details(details_text):
     # This often contains a bunch of HTML fluff of <br>s and masked phone numbers
-    details_text = re.sub(r"<br\s*/?>", "\n", details_text, flags=re.IGNORECASE)
-    details_text = re.sub(
-        r"\s*<span[^>]*>.*?</span>\s*", " **** ", details_text, flags=re.DOTALL
-    )
+    details_text = BR_TAG_PATTERN.sub("\n", details_text)
+    details_text = SPAN_TAG_PATTERN.sub(" **** ", details_text)
     details_text = details_text.replace("\xa0", " ")
     details_text = details_text.replace("&gt;", ">")
     details_text = details_text.replace("&lt;", "<")
     details_text = details_text.replace("&amp;", "&")
     details_text = details_text.replace("&quot;", '"')
-    details_text = re.sub(r"\n\s*\n+", "\n\n", details_text).strip()
+    details_text = REPEATED_BLANK_LINES_PATTERN.sub("\n\n", details_text).strip()
     return details_text
 
 
 def _parse_top_year(year_text, listing_url):
-    match = re.search(TOP_YEAR_PATTERN, year_text)
+    match = TOP_YEAR_PATTERN.search(year_text)
     if match is None:
         # Sometimes there is just no TOP year item, and we use the same icon for Listing ID item;
         # we still return None in this case, but omit the warning since this is an expected outcome
-        if re.search(LISTING_ID_PATTERN, year_text) is None:
+        if LISTING_ID_PATTERN.search(year_text) is None:
             logger.error(
                 f"TOP year item {year_text} did not match the known pattern for {listing_url}"
             )
@@ -368,7 +395,7 @@ def _parse_listed_date(listed_date_text, listing_data, listing_url):
     unix_time = listing_data["lastPosted"]["unix"]
     unix_date = datetime.datetime.fromtimestamp(unix_time, tz=SINGAPORE_TIMEZONE)
 
-    match = re.search(LISTED_DATE_PATTERN, listed_date_text)
+    match = LISTED_DATE_PATTERN.search(listed_date_text)
     if match is None:
         logger.error(
             f"Listed date item {listed_date_text} did not match the known pattern for {listing_url}"
@@ -378,7 +405,7 @@ def _parse_listed_date(listed_date_text, listing_data, listing_url):
     day, month, year = match.groups()
     text_date = datetime.datetime(
         year=int(year),
-        month=datetime.datetime.strptime(month, "%b").month,
+        month=MONTH_NUMS_BY_ABBREVIATION[month.lower()],
         day=int(day),
     )
     if text_date.date() != unix_date.date():